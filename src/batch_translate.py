@@ -0,0 +1,225 @@
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os import getenv
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from dotenv import load_dotenv
+
+from modules.audio import INT16_SCALE, WHISPER_SAMPLE_RATE
+from modules.logger import logger
+from modules.subtitle_formats import WRITERS
+
+load_dotenv()
+
+TARGET_LANGUAGE_CODE = getenv('TARGET_LANGUAGE_CODE')
+WHISPER_MODEL = getenv('WHISPER_MODEL', "small.en")
+WHISPER_PROFILE = getenv('WHISPER_PROFILE', 'balanced')
+# files are decoded and transcribed this many seconds at a time, so a long video never sits in memory as a whole
+WINDOW_SECONDS = 300
+# a window ends at the quietest moment of its last few seconds instead of in the middle of a word
+SPLIT_SEARCH_SECONDS = 5
+MEDIA_EXTENSIONS = {'.wav', '.mp3', '.flac', '.ogg', '.m4a', '.aac', '.opus', '.mp4', '.mkv', '.webm', '.mov', '.avi'}
+
+# one whisper model per worker process, created by init_worker
+worker_model = None
+worker_profile = None
+
+
+def init_worker(model_name: str, profile: str, cpu_threads: int):
+    global worker_model, worker_profile
+    from modules.transcription import create_model
+    worker_model = create_model(model_name, profile, device="cpu", cpu_threads=cpu_threads)
+    worker_profile = profile
+
+
+def quiet_point(audio: np.ndarray) -> int:
+    # middle of the quietest 100ms block in the last SPLIT_SEARCH_SECONDS of the audio
+    block = WHISPER_SAMPLE_RATE // 10
+    tail = audio[-SPLIT_SEARCH_SECONDS * WHISPER_SAMPLE_RATE:]
+    blocks = len(tail) // block
+    energy = np.abs(tail[:blocks * block].astype(np.float32)).reshape(blocks, block).mean(axis=1)
+    return len(audio) - len(tail) + int(np.argmin(energy)) * block + block // 2
+
+
+def decode_windows(path: str, window_seconds: float = WINDOW_SECONDS):
+    # pyav decodes the file frame by frame into 16kHz mono audio, which is handed out one window at a time
+    import av
+
+    window = int(window_seconds * WHISPER_SAMPLE_RATE)
+    resampler = av.AudioResampler(format='s16', layout='mono', rate=WHISPER_SAMPLE_RATE)
+    buffered, size = [], 0
+    with av.open(path, metadata_errors='ignore') as container:
+        # None flushes the resampler
+        for frame in itertools.chain(container.decode(audio=0), [None]):
+            for resampled in resampler.resample(frame):
+                samples = resampled.to_ndarray().reshape(-1)
+                buffered.append(samples)
+                size += len(samples)
+            if size < window:
+                continue
+            audio = np.concatenate(buffered)
+            while len(audio) >= window:
+                cut = quiet_point(audio[:window])
+                yield audio[:cut].astype(np.float32) * INT16_SCALE
+                audio = audio[cut:]
+            buffered, size = [audio], len(audio)
+    if size:
+        yield np.concatenate(buffered).astype(np.float32) * INT16_SCALE
+
+
+def transcribe_file(path: str, language: str = None, task: str = 'transcribe',
+                    window_seconds: float = WINDOW_SECONDS) -> dict:
+    # runs in a worker process, cue times are shifted by the length of the windows before them
+    from modules.transcription import transcribe_options
+    start = time.time()
+    options = transcribe_options(language, worker_profile, task=task)
+    if language:
+        # --from holds whatever the profile, only an unset language is left to whisper to detect
+        options["language"] = language
+    cues = []
+    offset = 0.0
+    for audio in decode_windows(path, window_seconds):
+        segments, info = worker_model.transcribe(audio, **options)
+        cues.extend((offset + segment.start, offset + segment.end, segment.text) for segment in segments)
+        offset += len(audio) / WHISPER_SAMPLE_RATE
+        # the language of the first window holds for the whole file, it is what the cues are translated from
+        options.setdefault("language", info.language)
+    return {"path": path, "language": options.get("language"), "task": task, "cues": cues,
+            "duration": offset, "took": time.time() - start}
+
+
+def find_media(inputs: List[str]) -> List[Path]:
+    files = []
+    for item in map(Path, inputs):
+        if item.is_dir():
+            files.extend(sorted(p for p in item.rglob('*') if p.suffix.lower() in MEDIA_EXTENSIONS))
+        elif item.is_file():
+            files.append(item)
+        else:
+            logger.error(f"{item} does not exist")
+    return files
+
+
+def translate_cues(cues, from_code: str, to_code: str):
+    from modules.translation import translate_batch
+
+    if from_code == to_code:
+        return cues
+    # every line of the file goes to the backend in as few calls as possible
+    translated = translate_batch([text.strip() for _, _, text in cues], from_code, to_code)
+    return [(start, end, text) for (start, end, _), text in zip(cues, translated)]
+
+
+def dub(cues, to_code: str, path: Path):
+    # every line is synthesized and placed at its start time, overlapping lines are mixed
+    import soundfile as sf
+    from modules.tts import synthesize
+
+    clips = []
+    for start, _, text in cues:
+        pcm = synthesize(text, to_code)
+        samples = pcm.samples.astype(np.float32)
+        if pcm.samples.dtype == np.int16:
+            samples *= INT16_SCALE
+        clips.append((start, samples.reshape(len(samples), -1), pcm.sample_rate))
+    if not clips:
+        return
+
+    sample_rate = clips[0][2]
+    channels = max(clip.shape[1] for _, clip, _ in clips)
+    length = max(int(start * sample_rate) + len(clip) for start, clip, _ in clips)
+    timeline = np.zeros((length, channels), dtype=np.float32)
+    for start, clip, _ in clips:
+        offset = int(start * sample_rate)
+        timeline[offset:offset + len(clip)] += clip
+    sf.write(str(path), np.clip(timeline, -1, 1), sample_rate)
+
+
+def write_outputs(path: Path, result: dict, args, formats: List[str]):
+    if result["task"] == 'translate':
+        # whisper wrote english cues directly
+        cues = result["cues"]
+    else:
+        cues = translate_cues(result["cues"], result["language"], args.to)
+
+    output_dir = Path(args.output_dir) if args.output_dir else path.parent
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for f in formats:
+        WRITERS[f](output_dir / f'{path.stem}.{args.to}.{f}', cues)
+    if args.dub:
+        dub(cues, args.to, output_dir / f'{path.stem}.{args.to}.wav')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Transcribe and translate media files into subtitles offline.')
+    parser.add_argument('inputs', nargs='+', help='audio / video files or directories containing them')
+    parser.add_argument('-o', '--output-dir', help='where to write subtitles, next to each input by default')
+    parser.add_argument('--to', default=TARGET_LANGUAGE_CODE, help='language to translate to')
+    parser.add_argument('--from', dest='from_code', help='language spoken in the files, detected by whisper if unset')
+    parser.add_argument('--formats', default='srt,vtt', help='comma separated subtitle formats: srt, vtt')
+    parser.add_argument('--dub', action='store_true', help='also write a dubbed wav file using text to speech')
+    parser.add_argument('--model', default=WHISPER_MODEL, help='whisper model to use')
+    parser.add_argument('--profile', default=WHISPER_PROFILE, help='whisper profile: realtime, balanced or accurate')
+    parser.add_argument('--threads-per-worker', type=int, default=2, help='cpu threads used by each whisper worker')
+    parser.add_argument('--workers', type=int, help='whisper worker processes, fills every core by default')
+    parser.add_argument('--window', type=float, default=WINDOW_SECONDS,
+                        help='seconds of audio decoded and transcribed at a time')
+    args = parser.parse_args()
+
+    formats = [f.strip() for f in args.formats.split(',') if f.strip()]
+    for f in formats:
+        if f not in WRITERS:
+            parser.error(f'unknown subtitle format: {f}')
+
+    files = find_media(args.inputs)
+    if not files:
+        parser.error('no media files found')
+    workers = args.workers or max(1, (os.cpu_count() or 1) // args.threads_per_worker)
+    workers = min(workers, len(files))
+    logger.info(f"transcribing {len(files)} files with {workers} workers x {args.threads_per_worker} threads")
+    from modules import translation
+    # the translator is set up before any file is transcribed, so a backend that cannot translate to --to fails now
+    # instead of after every file
+    try:
+        translation.load([args.to])
+    except ValueError as e:
+        parser.error(str(e))
+    # with the WHISPER backend, english subtitles come straight out of whisper
+    task = translation.speech_task(args.to)
+    if task == 'translate' and args.model.endswith('.en'):
+        parser.error(f"the WHISPER backend needs a multilingual model, not {args.model}")
+
+    start = time.time()
+    audio_seconds = 0.0
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(args.model, args.profile, args.threads_per_worker)) as pool:
+        futures = {pool.submit(transcribe_file, str(path), args.from_code, task, args.window): path for path in files}
+        # files are translated and written here while the workers keep transcribing the others
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                result = future.result()
+            except Exception:
+                logger.exception(f"failed to transcribe {path}")
+                continue
+
+            audio_seconds += result["duration"]
+            logger.info(f"transcribed {path.name} ({result['language']}, {result['duration']:.0f}s) "
+                        f"| took {result['took']:.1f}s")
+            # a file that fails to translate, write or dub is skipped, the rest of the run goes on
+            try:
+                write_outputs(path, result, args, formats)
+            except Exception:
+                logger.exception(f"failed to translate {path}")
+
+    took = time.time() - start
+    logger.info(f"done, {audio_seconds:.0f}s of audio in {took:.0f}s ({audio_seconds / max(took, 1e-9):.1f}x realtime)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import json
+import platform
+import subprocess
+import time
+from pathlib import Path
+from typing import List, Sequence
+
+SAMPLES_DIR = Path(__file__).resolve().parent.parent / 'audio' / 'samples'
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+
+
+def percentile(values: Sequence[float], p: float) -> float:
+    # linear interpolation between the closest ranks, like numpy's default
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(values: Sequence[float]) -> dict:
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+    }
+
+
+def edit_distance(reference: Sequence, hypothesis: Sequence) -> int:
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref in enumerate(reference, 1):
+        current = [i]
+        for j, hyp in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref != hyp)))
+        previous = current
+    return previous[-1]
+
+
+def _tokens(text: str) -> List[str]:
+    return ''.join(c.lower() if c.isalnum() or c.isspace() else ' ' for c in text).split()
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    words = _tokens(reference)
+    return edit_distance(words, _tokens(hypothesis)) / max(len(words), 1)
+
+
+def char_error_rate(reference: str, hypothesis: str) -> float:
+    # japanese has no spaces between words, so the character rate is the meaningful one there
+    chars = ''.join(_tokens(reference))
+    return edit_distance(chars, ''.join(_tokens(hypothesis))) / max(len(chars), 1)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).parent).stdout.strip()
+    except OSError:
+        return ''
+
+
+def write_results(name: str, results: dict, output: str = None) -> Path:
+    """Write results as json with the commit and machine they were measured on, so runs can be compared."""
+    path = Path(output) if output else RESULTS_DIR / f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    report = {"benchmark": name, "revision": git_revision(), "machine": platform.platform(),
+              "python": platform.python_version(), "created": time.time(), "results": results}
+    path.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding='utf-8')
+    return path
@@ -0,0 +1,268 @@
+"""End-to-end latency of the voice translator, stage by stage, without any audio hardware.
+
+    python -m benchmarks.latency [--models tiny base small] [--engines voicevox coqui] [--runs 5]
+
+Run from src. Recorded samples are written into a fake capture engine the way the microphone callback would,
+playback goes to a fake output stream and the online translators are replaced by a mock with a fixed delay,
+so results only depend on this machine and this commit. Every whisper model and tts engine pair runs in a
+process of its own, because the tts engines are picked from the target languages when modules.tts is imported.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from threading import Thread
+
+import numpy as np
+
+# language each tts engine is benchmarked with, see the import in modules.tts
+ENGINE_LANGUAGES = {'voicevox': 'ja', 'coqui': 'de'}
+STAGES = ['capture', 'vad', 'transcribe', 'translate', 'synthesize', 'first_audio', 'total']
+
+
+class MockTranslator:
+    """Stands in for deepl.Translator and googletrans.Translator, returns the text after a fixed delay."""
+
+    class Result:
+        def __init__(self, text):
+            self.text = text
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def _translate(self, texts):
+        time.sleep(self.latency)
+        return [self.Result(text) for text in texts] if isinstance(texts, list) else self.Result(texts)
+
+    def translate_text(self, texts, target_lang=None):
+        return self._translate(texts)
+
+    def translate(self, texts, dest=None):
+        return self._translate(texts)
+
+
+class FakeOutputStream:
+    """sounddevice.OutputStream that discards the audio and remembers when the first frame was written."""
+
+    first_write = None
+
+    def __init__(self, samplerate, channels, dtype, device=None):
+        self.samplerate = samplerate
+
+    def start(self):
+        pass
+
+    def write(self, data):
+        if FakeOutputStream.first_write is None:
+            FakeOutputStream.first_write = time.time()
+
+    def stop(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def fake_capture_engine(sample_rate: int, channels: int):
+    from modules.audio import RingBuffer
+    from modules.capture import CAPTURE_BUFFER_SECONDS, CHUNK, CaptureEngine
+
+    class FakeCaptureEngine(CaptureEngine):
+        """Capture engine without a device, feed() calls the stream callback like portaudio would."""
+
+        def __init__(self, pre_roll_ms: int = 0):
+            self.device_index = None
+            self.channels = channels
+            self.sample_rate = sample_rate
+            self.pre_roll = sample_rate * pre_roll_ms // 1000
+            self.ring = RingBuffer(sample_rate * CAPTURE_BUFFER_SECONDS)
+            self._stream = None
+
+        def start(self):
+            pass
+
+        def close(self):
+            pass
+
+        def feed(self, pcm: np.ndarray):
+            # pcm is int16, interleaved like the microphone's frames
+            frame_size = CHUNK * channels
+            for start in range(0, len(pcm), frame_size):
+                block = pcm[start:start + frame_size]
+                self._callback(block.tobytes(), len(block) // channels, None, 0)
+
+    return FakeCaptureEngine()
+
+
+def read_sample(path: Path):
+    import wave
+    with wave.open(str(path), 'rb') as wav:
+        assert wav.getsampwidth() == 2, 'samples must be 16 bit pcm'
+        pcm = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+        return pcm, wav.getframerate(), wav.getnchannels()
+
+
+def run_utterance(pcm: np.ndarray, sample_rate: int, channels: int, source: str, target: str, vad) -> dict:
+    from modules import tts
+    from modules.chunking import split_sentences
+    from modules.transcription import transcribe_segments
+    from modules.translation import translate
+
+    capture = fake_capture_engine(sample_rate, channels)
+    recording = capture.recording()
+    capture.feed(pcm)
+
+    timings = dict.fromkeys(['vad', 'transcribe', 'translate', 'synthesize'], 0.0)
+    FakeOutputStream.first_write = None
+    # the record key goes up here, everything below is what the user waits for
+    released = time.time()
+    recording.stop()
+    audio = recording.to_whisper()
+    timings['capture'] = time.time() - released
+
+    if vad is not None:
+        start = time.time()
+        audio = vad.trim(audio)
+        timings['vad'] = time.time() - start
+
+    # every segment is translated and synthesized as soon as it is decoded, playback starts on the first chunk
+    stream = tts.SpeechStream()
+    player = Thread(target=tts.play_stream, args=[stream, tts.CABLE_INPUT_ID])
+    player.start()
+    try:
+        segments = transcribe_segments(audio, source)
+        while True:
+            start = time.time()
+            segment = next(segments, None)
+            timings['transcribe'] += time.time() - start
+            if segment is None:
+                break
+            if not segment["text"].strip():
+                continue
+
+            start = time.time()
+            translated = translate(segment["text"], segment["language"], target)
+            timings['translate'] += time.time() - start
+
+            start = time.time()
+            for chunk in split_sentences(translated):
+                data, fs = tts.synthesize(chunk, target)
+                stream.put(data, fs)
+            timings['synthesize'] += time.time() - start
+    finally:
+        stream.close()
+        player.join()
+
+    timings['total'] = time.time() - released
+    timings['first_audio'] = (FakeOutputStream.first_write - released) if FakeOutputStream.first_write else None
+    timings['audio_seconds'] = recording.duration
+    return timings
+
+
+def run_worker(args) -> dict:
+    # runs in the child process, modules are imported only now that the environment is set up
+    from unittest import mock
+    from modules import transcription, translation, tts
+    from modules.translation import TranslationBackend
+    from modules.vad import VAD, VoiceActivityDetector
+    from .common import summarize
+
+    # caches would turn every run after the first into a lookup
+    translation.translation_cache = None
+    tts.tts_cache = None
+    if args.translator != 'argos':
+        translation.TRANSLATION_BACKEND = TranslationBackend[args.translator.upper()]
+        translation.google_translator = translation.deepl_translator = MockTranslator(args.translator_latency / 1000)
+        translation._loaded = True
+
+    start = time.time()
+    transcription.load()
+    translation.load()
+    tts.load()
+    load_seconds = time.time() - start
+
+    samples = [Path(path) for path in args.samples]
+    results = {"load_seconds": load_seconds, "samples": {}}
+    vad = VoiceActivityDetector() if VAD else None
+    with mock.patch.object(tts.sd, 'OutputStream', FakeOutputStream):
+        for path in samples:
+            pcm, sample_rate, channels = read_sample(path)
+            # the first run loads lazily initialized state and is not counted
+            runs = [run_utterance(pcm, sample_rate, channels, args.source, args.target, vad)
+                    for _ in range(args.runs + 1)][1:]
+            results["samples"][path.stem] = {
+                "audio_seconds": runs[0]['audio_seconds'],
+                "stages": {stage: summarize([run[stage] for run in runs if run[stage] is not None])
+                           for stage in STAGES},
+            }
+    return results
+
+
+def main():
+    from .common import SAMPLES_DIR, write_results
+
+    parser = argparse.ArgumentParser(description='Measure the latency of every stage of the voice translator.')
+    parser.add_argument('--models', nargs='+', default=['tiny', 'base', 'small'], help='whisper models to compare')
+    parser.add_argument('--engines', nargs='+', default=list(ENGINE_LANGUAGES), choices=list(ENGINE_LANGUAGES),
+                        help='tts engines to compare')
+    parser.add_argument('--samples', nargs='+', default=[str(path) for path in sorted(SAMPLES_DIR.glob('*.wav'))],
+                        help='16 bit wav recordings to use as microphone input')
+    parser.add_argument('--source', default='ja', help='language spoken in the samples')
+    parser.add_argument('--translator', default='deepl', choices=['deepl', 'google', 'argos'],
+                        help='deepl and google are mocked, argos runs for real')
+    parser.add_argument('--translator-latency', type=float, default=150,
+                        help='round-trip time of the mocked online translator in ms')
+    parser.add_argument('--runs', type=int, default=5, help='timed runs per sample')
+    parser.add_argument('-o', '--output', help='json file to write, defaults to benchmarks/results')
+    # internal, set when main() starts the process for one model and engine
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--target', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args)))
+        return
+
+    results = {}
+    for model in args.models:
+        for engine in args.engines:
+            print(f"[BENCH] whisper {model} / {engine}")
+            target = ENGINE_LANGUAGES[engine]
+            env = {**os.environ, 'WHISPER_MODEL': model, 'TARGET_LANGUAGE_CODE': target,
+                   'TARGET_LANGUAGE_CODES': target, 'SOURCE_LANGUAGE_CODE': args.source}
+            # the audio devices are fake, but modules read their ids at import
+            env.setdefault('CABLE_INPUT_ID', '0')
+            env.setdefault('VOICE_ID', '1')
+            # never press the in-game push to talk key from a benchmark
+            env['INGAME_PUSH_TO_TALK_KEY'] = ''
+            command = [sys.executable, '-m', 'benchmarks.latency', '--worker', '--target', target,
+                       '--source', args.source, '--translator', args.translator,
+                       '--translator-latency', str(args.translator_latency), '--runs', str(args.runs),
+                       '--samples', *args.samples]
+            child = subprocess.run(command, env=env, capture_output=True, text=True,
+                                   cwd=Path(__file__).resolve().parent.parent)
+            if child.returncode != 0:
+                print(child.stderr, file=sys.stderr)
+                results[f"{model}/{engine}"] = {"error": child.stderr.strip().splitlines()[-1:]}
+                continue
+            # modules print while loading, the report is the last line
+            result = json.loads(child.stdout.strip().splitlines()[-1])
+            results[f"{model}/{engine}"] = result
+
+            for name, sample in result["samples"].items():
+                print(f"  {name} ({sample['audio_seconds']:.1f}s of audio)")
+                for stage in STAGES:
+                    stats = sample["stages"][stage]
+                    print(f"    {stage:<12} p50 {stats['p50'] * 1000:8.1f}ms  p95 {stats['p95'] * 1000:8.1f}ms"
+                          f"  p99 {stats['p99'] * 1000:8.1f}ms")
+
+    path = write_results('latency', {"translator": args.translator, "translator_latency_ms": args.translator_latency,
+                                     "runs": args.runs, "pairs": results}, args.output)
+    print(f"[BENCH] results written to {path}")
+
+
+if __name__ == '__main__':
+    main()
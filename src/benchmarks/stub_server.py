@@ -0,0 +1,86 @@
+"""Local stand-in for the DeepL and Google translate apis, with configurable latency and failures.
+
+    python -m benchmarks.stub_server [--port 8900] [--latency 150] [--slow-rate 0.05] [--error-rate 0.02]
+
+Point the voice translator at it with DEEPL_API_URL=http://localhost:8900 or GOOGLE_TRANSLATE_URL=http://localhost:8900
+to see how deadlines, hedged requests, retries and the argos fallback behave when the api is slow or failing.
+Translations are the original text in brackets with the target language.
+"""
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # keep-alive, like the real apis
+    protocol_version = 'HTTP/1.1'
+    options = None
+
+    def do_POST(self):
+        # deepl: form encoded text=...&text=...&target_lang=...
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode('utf-8'))
+        if urlsplit(self.path).path != '/v2/translate':
+            return self._answer(404, {"message": "not found"})
+        target = form.get('target_lang', ['?'])[0]
+        self._respond(lambda: {"translations": [{"detected_source_language": "JA", "text": f"[{target}] {text}"}
+                                                for text in form.get('text', [])]})
+
+    def do_GET(self):
+        # google: /translate_a/single?client=gtx&tl=...&q=...
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path != '/translate_a/single':
+            return self._answer(404, {"message": "not found"})
+        target = query.get('tl', ['?'])[0]
+        text = query.get('q', [''])[0]
+        self._respond(lambda: [[[f"[{target}] {text}", text, None, None]], None, "ja"])
+
+    def _respond(self, body):
+        options = self.options
+        roll = random.random()
+        if roll < options.error_rate:
+            return self._answer(500, {"message": "stub error"})
+        if roll < options.error_rate + options.rate_limit_rate:
+            return self._answer(429, {"message": "too many requests"}, {'Retry-After': '1'})
+        latency = options.latency / 1000
+        if random.random() < options.slow_rate:
+            # the tail that hedged requests are meant to cut off
+            latency *= options.slow_factor
+        time.sleep(latency)
+        self._answer(200, body())
+
+    def _answer(self, status, body, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stub DeepL and Google translate apis.')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=150, help='ms every answer takes')
+    parser.add_argument('--slow-rate', type=float, default=0.05, help='share of answers that are slow')
+    parser.add_argument('--slow-factor', type=float, default=10, help='how many times slower the slow answers are')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with a 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='share of requests answered with a 429')
+    StubHandler.options = parser.parse_args()
+
+    server = ThreadingHTTPServer(('', StubHandler.options.port), StubHandler)
+    print(f"[STUB] translating on http://localhost:{StubHandler.options.port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
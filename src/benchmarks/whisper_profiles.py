@@ -0,0 +1,90 @@
+"""Latency and accuracy of every whisper profile on the bundled samples.
+
+    python -m benchmarks.whisper_profiles [--model small] [--runs 3] [--reference sample.txt]
+
+Run from src. Without a reference transcript the accurate profile's output is used as the reference,
+so the error rates show how much each faster profile gives up against it.
+"""
+import argparse
+import time
+from pathlib import Path
+
+from faster_whisper.audio import decode_audio
+
+from modules.audio import WHISPER_SAMPLE_RATE
+from modules.transcription import WHISPER_MODEL, WHISPER_PROFILES, create_model, transcribe_options
+from .common import SAMPLES_DIR, char_error_rate, summarize, word_error_rate, write_results
+
+# expected spoken language of each bundled sample, used by profiles that force the language
+SAMPLE_LANGUAGES = {'japanese': 'ja', 'english': 'en'}
+
+
+def sample_language(path: Path) -> str:
+    return SAMPLE_LANGUAGES.get(path.stem.split('_')[0])
+
+
+def run_profile(model_name: str, profile: str, samples: dict, runs: int) -> dict:
+    start = time.time()
+    model = create_model(model_name, profile)
+    load_seconds = time.time() - start
+
+    results = {"load_seconds": load_seconds, "samples": {}}
+    for name, (audio, language) in samples.items():
+        duration = len(audio) / WHISPER_SAMPLE_RATE
+        options = transcribe_options(language, profile)
+        latencies = []
+        text = ''
+        # the first run is a warm up and is not timed
+        for run in range(runs + 1):
+            start = time.time()
+            segments, info = model.transcribe(audio, **options)
+            text = ''.join(segment.text for segment in segments)
+            if run:
+                latencies.append(time.time() - start)
+        results["samples"][name] = {
+            "duration": duration,
+            "language": info.language,
+            "text": text,
+            "latency": summarize(latencies),
+            "rtf": summarize([latency / duration for latency in latencies]),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the latency and accuracy of the whisper profiles.')
+    parser.add_argument('--model', default=WHISPER_MODEL, help='whisper model to use')
+    parser.add_argument('--profiles', nargs='+', default=list(WHISPER_PROFILES), choices=list(WHISPER_PROFILES))
+    parser.add_argument('--runs', type=int, default=3, help='timed runs per sample')
+    parser.add_argument('--reference', action='append', default=[],
+                        help='text file with the transcript of the sample of the same name, can be repeated')
+    parser.add_argument('-o', '--output', help='json file to write, defaults to benchmarks/results')
+    args = parser.parse_args()
+
+    samples = {path.stem: (decode_audio(str(path), sampling_rate=WHISPER_SAMPLE_RATE), sample_language(path))
+               for path in sorted(SAMPLES_DIR.glob('*.wav'))}
+    references = {Path(path).stem: Path(path).read_text(encoding='utf-8') for path in args.reference}
+
+    results = {}
+    for profile in args.profiles:
+        print(f"[BENCH] {args.model} / {profile}")
+        results[profile] = run_profile(args.model, profile, samples, args.runs)
+
+    for name in samples:
+        reference = references.get(name)
+        if reference is None and 'accurate' in results:
+            reference = results['accurate']["samples"][name]["text"]
+        for profile in results:
+            sample = results[profile]["samples"][name]
+            if reference is not None:
+                sample["wer"] = word_error_rate(reference, sample["text"])
+                sample["cer"] = char_error_rate(reference, sample["text"])
+            print(f"{name:<28} {profile:<9} p50 {sample['latency']['p50']:.2f}s  rtf {sample['rtf']['p50']:.2f}"
+                  f"  wer {sample.get('wer', float('nan')):.2f}  cer {sample.get('cer', float('nan')):.2f}")
+
+    path = write_results('whisper_profiles', {"model": args.model, "profiles": results}, args.output)
+    print(f"[BENCH] results written to {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import time
+from os import getenv
+from pathlib import Path
+from threading import Lock
+
+import argostranslate.package
+import argostranslate.settings
+from dotenv import load_dotenv
+
+from .logger import logger
+
+load_dotenv()
+
+# hours before the cached copy of the argos package index is downloaded again
+ARGOS_INDEX_REFRESH_HOURS = float(getenv('ARGOS_INDEX_REFRESH_HOURS', 24))
+
+_ready_pairs = set()
+_lock = Lock()
+
+
+def _version(package) -> tuple:
+    try:
+        return tuple(int(part) for part in str(package.package_version).split('.'))
+    except ValueError:
+        return ()
+
+
+def _find(packages, from_code: str, to_code: str):
+    return next((x for x in packages if x.from_code == from_code and x.to_code == to_code), None)
+
+
+def _refresh_index():
+    # the index is kept on disk by argos, only download it again once it is older than the refresh interval
+    index = Path(argostranslate.settings.local_package_index)
+    if index.is_file() and time.time() - index.stat().st_mtime < ARGOS_INDEX_REFRESH_HOURS * 3600:
+        return
+    try:
+        argostranslate.package.update_package_index()
+    except Exception as e:
+        if not index.is_file():
+            raise
+        logger.warning(f"[ARGOS] could not refresh the package index, using the cached one: {e}")
+
+
+def ensure_package(from_code: str, to_code: str):
+    """Make sure the from_code -> to_code package is installed, going online only when it is missing or outdated."""
+    if (from_code, to_code) in _ready_pairs:
+        return
+
+    with _lock:
+        if (from_code, to_code) in _ready_pairs:
+            return
+
+        installed = _find(argostranslate.package.get_installed_packages(), from_code, to_code)
+        try:
+            _refresh_index()
+            available = _find(argostranslate.package.get_available_packages(), from_code, to_code)
+        except Exception as e:
+            if installed is None:
+                raise
+            logger.warning(f"[ARGOS] offline, using installed {from_code} -> {to_code} package: {e}")
+            available = None
+
+        if installed is not None and (available is None or _version(available) <= _version(installed)):
+            _ready_pairs.add((from_code, to_code))
+            return
+
+        if available is None:
+            raise ValueError(f"no argos package translates {from_code} -> {to_code}")
+
+        print(f"[ARGOS] installing {from_code} -> {to_code} package {available.package_version}..")
+        try:
+            argostranslate.package.install_from_path(available.download())
+        except Exception as e:
+            if installed is None:
+                raise
+            logger.warning(f"[ARGOS] could not update the {from_code} -> {to_code} package, keeping the installed one: {e}")
+        print(f"[ARGOS] {from_code} -> {to_code} package ready")
+        _ready_pairs.add((from_code, to_code))
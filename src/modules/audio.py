@@ -0,0 +1,103 @@
+import struct
+from typing import NamedTuple
+
+import numpy as np
+
+# faster-whisper expects 16 kHz mono float32 audio when given an array
+WHISPER_SAMPLE_RATE = 16000
+INT16_SCALE = 1 / 32768
+
+
+class PCM(NamedTuple):
+    """Synthesized audio as returned by the text to speech engines."""
+    samples: np.ndarray  # (frames,) or (frames, channels)
+    sample_rate: int
+
+
+def wav_to_pcm(wav: bytes) -> PCM:
+    # parse the RIFF header and view the data chunk in place instead of copying it
+    view = memoryview(wav)
+    if bytes(view[0:4]) != b'RIFF' or bytes(view[8:12]) != b'WAVE':
+        raise ValueError('not a RIFF/WAVE buffer')
+
+    channels, sample_rate, bits = 1, 0, 16
+    offset = 12
+    while offset + 8 <= len(view):
+        chunk_id = bytes(view[offset:offset + 4])
+        (chunk_size,) = struct.unpack_from('<I', view, offset + 4)
+        body = offset + 8
+        if chunk_id == b'fmt ':
+            _, channels, sample_rate, _, _, bits = struct.unpack_from('<HHIIHH', view, body)
+        elif chunk_id == b'data':
+            if bits != 16:
+                raise ValueError(f'unsupported sample width: {bits} bits')
+            data = view[body:min(body + chunk_size, len(view))]
+            samples = np.frombuffer(data, dtype=np.int16)
+            return PCM(samples.reshape(-1, channels) if channels > 1 else samples, sample_rate)
+        # chunks are padded to an even size
+        offset = body + chunk_size + (chunk_size & 1)
+    raise ValueError('wav buffer has no data chunk')
+
+
+def to_mono(samples: np.ndarray) -> np.ndarray:
+    if samples.ndim == 1:
+        return samples
+    if samples.shape[1] == 1:
+        return samples[:, 0]
+    return samples.mean(axis=1, dtype=np.float32)
+
+
+def resample(samples: np.ndarray, sample_rate: int, target_rate: int = WHISPER_SAMPLE_RATE) -> np.ndarray:
+    if sample_rate == target_rate or len(samples) == 0:
+        return samples
+    # linear interpolation is plenty for speech going into whisper
+    duration = len(samples) / sample_rate
+    target_length = int(duration * target_rate)
+    positions = np.linspace(0, len(samples) - 1, target_length, dtype=np.float32)
+    return np.interp(positions, np.arange(len(samples), dtype=np.float32), samples).astype(np.float32)
+
+
+class RingBuffer:
+    """Fixed size ring of mono float32 audio, addressed by absolute sample offsets since it was created.
+
+    Lock-free for one writer and any number of readers: the writer announces the range it is about to overwrite
+    before touching it, and readers retry when their copy may have been overwritten meanwhile.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.total = 0
+        self._reserved = 0
+        self._data = np.zeros(capacity, dtype=np.float32)
+
+    @property
+    def oldest(self) -> int:
+        # absolute offset of the oldest sample still in the ring
+        return max(0, self.total - self.capacity)
+
+    def write(self, samples: np.ndarray):
+        end = self.total + len(samples)
+        samples = samples[-self.capacity:]
+        self._reserved = end
+        index = (end - len(samples)) % self.capacity
+        first = min(len(samples), self.capacity - index)
+        self._data[index:index + first] = samples[:first]
+        self._data[:len(samples) - first] = samples[first:]
+        self.total = end
+
+    def read(self, start: int, end: int = None) -> np.ndarray:
+        # copies out [start, end), clamped to what is still in the ring
+        while True:
+            total = self.total
+            stop = total if end is None else min(end, total)
+            first_valid = max(start, total - self.capacity, 0)
+            length = max(0, stop - first_valid)
+            out = np.empty(length, dtype=np.float32)
+            index = first_valid % self.capacity
+            first = min(length, self.capacity - index)
+            out[:first] = self._data[index:index + first]
+            out[first:] = self._data[:length - first]
+            if self._reserved - self.capacity <= first_valid:
+                return out
+            # the writer lapped us while copying, start again from what is still valid
+            start = max(start, self._reserved - self.capacity)
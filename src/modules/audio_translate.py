@@ -1,48 +1,80 @@
+import time
 from datetime import datetime, timedelta
-from io import BytesIO
 from os import getenv
-from pathlib import Path
-from queue import Queue
-from threading import Thread
-from time import sleep
 
-import requests
+import numpy as np
 import speech_recognition as sr
 
-from .translation import translate
+from . import tracing
+from .audio import INT16_SCALE, WHISPER_SAMPLE_RATE, RingBuffer, resample
+from .streaming_transcription import IncrementalDecoder
+from .subtitles import SubtitleUpdate
+from .transcription_pool import TRANSCRIPTION_WORKERS, TranscriptionPool
+from .translation import BatchTranslator, speech_task
+from .vad import VAD, VoiceActivityDetector
 
 APP_OUTPUT_ID = int(getenv('AUX_OUTPUT_ID'))
 RECORD_TIMEOUT = int(getenv('RECORD_TIMEOUT'))
 PHRASE_TIMEOUT = int(getenv('PHRASE_TIMEOUT'))
-INPUT_LANGUAGE = getenv('TARGET_LANGUAGE_CODE')
+# Max seconds of a phrase kept in memory, older audio of very long phrases is dropped
+PHRASE_MAX_SECONDS = int(getenv('PHRASE_MAX_SECONDS', 30))
+# language spoken in the app's audio, whisper detects it when it is not set
+INPUT_LANGUAGE = getenv('SUBTITLE_LANGUAGE_CODE') or None
 LOGGING = getenv("LOGGING", 'False').lower() in ('true', '1', 't')
-APP_AUDIO_WAV_PATH = Path(__file__).resolve(
-).parent / 'audio' / r'app_audio.wav'
-
-
-def request_thread(queue, phrase_time, now):
-    try:
-        translation = translate(APP_AUDIO_WAV_PATH, INPUT_LANGUAGE)
-    except requests.exceptions.JSONDecodeError:
-        # Whisper is not thread-safe, see https://github.com/openai/whisper/discussions/296
-        # However, if we do not want a single request to block future audio, just catch the error
-        print('Too many requests to process at once')
+# subtitles are shown in english
+OUTPUT_LANGUAGE = 'en'
+# 'translate' when whisper writes the english subtitles itself, without a separate translation backend
+SPEECH_TASK = speech_task(OUTPUT_LANGUAGE)
+
+# requests finishing at about the same time on different workers share one backend call
+batch_translator = BatchTranslator(producers=TRANSCRIPTION_WORKERS)
+
+
+def process_request(queue, phrase_buffer, phrase_id, request, created, final=False):
+    trace = tracing.start_trace(phrase=phrase_id)
+    with trace.activate():
+        _process_request(queue, phrase_buffer, phrase_id, request, created, final)
+
+
+def _process_request(queue, phrase_buffer, phrase_id, request, created, final):
+    decoder, phrase_start, phrase_end = request
+    # time the request spent waiting for a free worker
+    tracing.record('subtitle_queue', time.time() - created)
+
+    # segments the decoder already committed are reused, only the audio after them is decoded again
+    start = phrase_start + int(decoder.committed_seconds * WHISPER_SAMPLE_RATE)
+    if start < phrase_buffer.oldest:
+        decoder.skip_to((phrase_buffer.oldest - phrase_start) / WHISPER_SAMPLE_RATE)
+        start = phrase_buffer.oldest
+    with tracing.span('whisper', audio_seconds=(phrase_end - start) / WHISPER_SAMPLE_RATE):
+        text = decoder.decode(phrase_buffer.read(start, phrase_end))
+    if not text:
         return
 
+    from_code = decoder.language or INPUT_LANGUAGE
+    if decoder.task == 'translate' or from_code == OUTPUT_LANGUAGE:
+        # whisper already wrote english
+        translation = text
+    else:
+        # includes the time spent waiting for the batch to fill up
+        with tracing.span('subtitle_translate', from_code=from_code):
+            translation = batch_translator.translate(text, from_code, OUTPUT_LANGUAGE)
     if translation:
-        queue.put(translation)
+        queue.put(SubtitleUpdate(phrase_id, translation, final))
+        # from the audio arriving until the subtitle is ready to be shown
+        tracing.record('subtitle', time.time() - created)
         # logging if needed
         if LOGGING:
-            delay = (datetime.utcnow() - now).total_seconds()
-            if phrase_time:
-                print(f'Previous time: {phrase_time.time().strftime("%H:%M:%S")}, Now: {now.time().strftime("%H:%M:%S")}, Delay: {delay}, Translation: {translation}')
-            else:
-                print(f'Now: {now.time()}, Delay: {delay}, Translation: {translation}')
+            delay = time.time() - created
+            print(f'Phrase: {phrase_id}, Delay: {delay}, Translation: {translation}')
 
 
 def translate_audio(translation_queue):
-    data_queue = Queue()
+    """Listens to app audio in the background and puts subtitles into translation_queue, returns a stop function.
 
+    translation_queue is anything with a thread-safe put(), e.g. a Queue or the subtitler's overlay. It receives a
+    SubtitleUpdate for every decoded window of a phrase, each one replacing the last until the phrase is final.
+    """
     # We use SpeechRecognizer to record our audio because it can detect when speech ends.
     recorder = sr.Recognizer()
     # dynamic energy compensation lowers the energy threshold to a point where SpeechRecognizer never stops recording.
@@ -51,46 +83,50 @@ def translate_audio(translation_queue):
     # listen to app audio output (voice-chat)
     audio_output = sr.Microphone(device_index=APP_OUTPUT_ID)
 
-    def record_callback(_, audio):
-        # Threaded callback function to push audio data to queue when recordings finish.
-        raw_data = audio.get_raw_data()
-        data_queue.put(raw_data)
-
-    # Create a background thread that will pass us raw audio bytes.
-    recorder.listen_in_background(audio_output, record_callback, phrase_time_limit=RECORD_TIMEOUT)
-
-    # The last time a recording was retrieved from the queue.
+    # 16kHz mono audio of the current phrase, bounded so long phrases do not grow memory or decode time.
+    phrase_buffer = RingBuffer(PHRASE_MAX_SECONDS * WHISPER_SAMPLE_RATE)
+    # Whisper workers, only the newest audio of each phrase is decoded and requests older than REQUEST_TIMEOUT are dropped.
+    pool = TranscriptionPool(
+        lambda request_phrase, request, created: process_request(
+            translation_queue, phrase_buffer, request_phrase, request, created,
+            # a newer phrase has started, so this window was the phrase's last one
+            final=request_phrase != phrase_id))
+    # game sound effects, music and silence are dropped before they reach whisper
+    vad = VoiceActivityDetector() if VAD else None
+
+    # The last time a recording was received.
     phrase_time = None
-    # Current raw audio bytes.
-    last_sample = bytes()
+    # Incremented every time a new phrase starts.
+    phrase_id = 0
+    # Offset in phrase_buffer where the current phrase starts and the decoder keeping its committed segments.
+    phrase_start = 0
+    decoder = IncrementalDecoder(language=INPUT_LANGUAGE, task=SPEECH_TASK)
 
-    while True:
+    def record_callback(_, audio):
+        # Threaded callback function, runs every time SpeechRecognizer finishes a recording, so nothing has to poll.
+        nonlocal phrase_time, phrase_id, phrase_start, decoder
         now = datetime.utcnow()
 
-        if not data_queue.empty():
-            # If enough time has passed between recordings, consider the phrase complete.
-            # Clear the current working audio buffer to start over with the new data.
-            prev_phrase_time = phrase_time
-            if phrase_time and now - phrase_time > timedelta(seconds=PHRASE_TIMEOUT):
-                last_sample = bytes()
-            # This is the last time we received new audio data from the queue.
-            phrase_time = now
-
-            # Concatenate our current audio data with the latest audio data.
-            while not data_queue.empty():
-                data = data_queue.get()
-                last_sample += data
-
-            # Write audio data to the wav file as bytes.
-            audio_data = sr.AudioData(last_sample, audio_output.SAMPLE_RATE, audio_output.SAMPLE_WIDTH)
-            wav_data = BytesIO(audio_data.get_wav_data())
-            with open(APP_AUDIO_WAV_PATH, 'w+b') as f:
-                f.write(wav_data.read())
-
-            # translate japanese audio to english and push to translation queue in thread
-            # TODO: Add a Mutex to ensure request is not to Whisper simultaneously??
-            Thread(target=request_thread, args=[translation_queue, prev_phrase_time, now], daemon=True).start()
-
-        else:
-            # Infinite loops are bad for processors, must sleep.
-            sleep(0.5)
+        # If enough time has passed between recordings, consider the phrase complete.
+        # Start the new phrase where the buffer currently ends.
+        if phrase_time and now - phrase_time > timedelta(seconds=PHRASE_TIMEOUT):
+            phrase_start = phrase_buffer.total
+            phrase_id += 1
+            decoder = IncrementalDecoder(language=INPUT_LANGUAGE, task=SPEECH_TASK)
+        # This is the last time we received new audio data.
+        phrase_time = now
+
+        # Append only the new audio, converted to 16kHz mono float32 for whisper.
+        samples = resample(np.frombuffer(audio.get_raw_data(), dtype=np.int16) * np.float32(INT16_SCALE),
+                           audio_output.SAMPLE_RATE)
+        if vad:
+            samples = vad.trim(samples)
+        if len(samples) == 0:
+            return
+        phrase_buffer.write(samples)
+
+        # translate japanese audio to english and push to translation queue from the worker pool
+        pool.submit(phrase_id, (decoder, phrase_start, phrase_buffer.total))
+
+    # Create a background thread that will pass us raw audio bytes.
+    return recorder.listen_in_background(audio_output, record_callback, phrase_time_limit=RECORD_TIMEOUT)
@@ -0,0 +1,90 @@
+from os import getenv
+from typing import Optional
+
+import numpy as np
+import pyaudio
+from dotenv import load_dotenv
+
+from .audio import INT16_SCALE, RingBuffer, resample, to_mono
+
+load_dotenv()
+
+# audio from before the record key went down that is kept, so the first syllable is never cut off
+PRE_ROLL_MS = int(getenv('PRE_ROLL_MS', 300))
+# longest recording that can be transcribed, older audio is overwritten
+CAPTURE_BUFFER_SECONDS = 120
+CHUNK = 1024
+FORMAT = pyaudio.paInt16
+
+
+class CaptureEngine:
+    """Keeps one callback driven input stream open and writes it into a ring buffer."""
+
+    def __init__(self, device_index: int, pre_roll_ms: int = PRE_ROLL_MS):
+        self._audio = pyaudio.PyAudio()
+
+        # get channels and sampling rate of mic
+        info = self._audio.get_device_info_by_index(device_index)
+        self.device_index = device_index
+        self.channels = info['maxInputChannels']
+        self.sample_rate = int(info['defaultSampleRate'])
+        self.pre_roll = self.sample_rate * pre_roll_ms // 1000
+
+        # mono float32 at the device's rate, only the portaudio callback writes to it
+        self.ring = RingBuffer(self.sample_rate * CAPTURE_BUFFER_SECONDS)
+        self._stream: Optional[pyaudio.Stream] = None
+
+    def start(self):
+        self._stream = self._audio.open(format=FORMAT,
+                                        channels=self.channels,
+                                        rate=self.sample_rate,
+                                        input=True,
+                                        frames_per_buffer=CHUNK,
+                                        input_device_index=self.device_index,
+                                        stream_callback=self._callback)
+        self._stream.start_stream()
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+        self._audio.terminate()
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        samples = np.frombuffer(in_data, dtype=np.int16).reshape(-1, self.channels)
+        self.ring.write(to_mono(samples * np.float32(INT16_SCALE)))
+        return None, pyaudio.paContinue
+
+    def mark(self) -> int:
+        # offset a recording starting now begins at, including the pre-roll
+        return max(self.ring.oldest, self.ring.total - self.pre_roll)
+
+    def recording(self) -> 'Recording':
+        return Recording(self, self.mark())
+
+
+class Recording:
+    """A slice of the capture engine's ring buffer, still growing until stop() is called."""
+
+    def __init__(self, engine: CaptureEngine, start: int):
+        self.engine = engine
+        self.sample_rate = engine.sample_rate
+        self.start = start
+        self.end: Optional[int] = None
+
+    def stop(self):
+        self.end = self.engine.ring.total
+
+    def __len__(self):
+        end = self.engine.ring.total if self.end is None else self.end
+        return end - self.start
+
+    @property
+    def duration(self) -> float:
+        return len(self) / self.sample_rate
+
+    def to_whisper(self, start: int = 0, end: int = None) -> np.ndarray:
+        # offsets are relative to the start of the recording
+        stop = self.end if end is None else self.start + end
+        return resample(self.engine.ring.read(self.start + start, stop), self.sample_rate)
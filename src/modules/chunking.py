@@ -0,0 +1,50 @@
+import re
+import unicodedata
+from os import getenv
+from typing import List
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# sentences longer than this are also split at clause boundaries (、, commas, ...)
+TTS_MAX_CHUNK_CHARS = int(getenv('TTS_MAX_CHUNK_CHARS', 40))
+# pieces shorter than this are merged with their neighbour, tiny chunks sound choppy
+TTS_MIN_CHUNK_CHARS = int(getenv('TTS_MIN_CHUNK_CHARS', 6))
+
+# full stops in latin and CJK text, an ascii period only counts when followed by whitespace (not 3.5)
+SENTENCE_BOUNDARY = re.compile(r'(?<=[。！？!?．…])|(?<=\.)(?=\s)|\n+')
+CLAUSE_BOUNDARY = re.compile(r'(?<=[、，,;；:：])')
+
+
+def normalize_text(text: str) -> str:
+    # NFKC folds full-width / half-width variants, so 「ナイスショット！」 and 「ﾅｲｽｼｮｯﾄ!」 share cache entries
+    return ' '.join(unicodedata.normalize('NFKC', text).split())
+
+
+def _split(pattern: re.Pattern, text: str) -> List[str]:
+    return [piece.strip() for piece in pattern.split(text) if piece.strip()]
+
+
+def _merge_short(pieces: List[str], min_chars: int) -> List[str]:
+    merged = []
+    for piece in pieces:
+        if merged and (len(merged[-1]) < min_chars or len(piece) < min_chars):
+            # keep a space between latin words, CJK text is written without spaces
+            separator = ' ' if merged[-1][-1].isascii() and piece[0].isascii() else ''
+            merged[-1] = merged[-1] + separator + piece
+        else:
+            merged.append(piece)
+    return merged
+
+
+def split_sentences(text: str, max_chars: int = TTS_MAX_CHUNK_CHARS,
+                    min_chars: int = TTS_MIN_CHUNK_CHARS) -> List[str]:
+    """Split text into chunks that can be synthesized one after another."""
+    chunks = []
+    for sentence in _split(SENTENCE_BOUNDARY, text):
+        if len(sentence) > max_chars:
+            chunks.extend(_split(CLAUSE_BOUNDARY, sentence))
+        else:
+            chunks.append(sentence)
+    return _merge_short(chunks, min_chars)
@@ -0,0 +1,17 @@
+from os import getenv
+from typing import Dict, List
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TARGET_LANGUAGE_CODE = getenv('TARGET_LANGUAGE_CODE')
+# every language an utterance is translated to and spoken in, side by side, e.g. "ja,de"
+TARGET_LANGUAGE_CODES: List[str] = [code.strip() for code in getenv('TARGET_LANGUAGE_CODES', '').split(',')
+                                    if code.strip()] or [TARGET_LANGUAGE_CODE]
+
+
+def parse_language_map(value: str) -> Dict[str, str]:
+    # "ja:12,de:14" -> {"ja": "12", "de": "14"}
+    pairs = (item.split(':', 1) for item in value.split(',') if ':' in item)
+    return {code.strip(): setting.strip() for code, setting in pairs}
@@ -0,0 +1,131 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from os import getenv
+from types import GeneratorType
+from typing import Callable, List, Optional
+
+from dotenv import load_dotenv
+
+from . import tracing
+from .logger import logger
+from .runtime import Runtime
+
+load_dotenv()
+
+
+class DropPolicy(Enum):
+    BLOCK = 'BLOCK'  # wait for the next stage to make room (backpressure)
+    DROP_OLDEST = 'DROP_OLDEST'  # discard the oldest queued item to make room for the new one
+    DROP_NEWEST = 'DROP_NEWEST'  # discard the new item when the queue is full
+
+
+PIPELINE_QUEUE_SIZE = int(getenv('PIPELINE_QUEUE_SIZE', 2))
+PIPELINE_DROP_POLICY = DropPolicy[getenv('PIPELINE_DROP_POLICY', 'BLOCK')]
+
+_STOP = object()
+
+
+class Stage:
+    """A pipeline stage: a bounded queue on the event loop and one worker thread running the blocking handler."""
+
+    def __init__(self, name: str, handler: Callable, maxsize: int = PIPELINE_QUEUE_SIZE,
+                 policy: DropPolicy = PIPELINE_DROP_POLICY):
+        self.name = name
+        self.handler = handler
+        self.policy = policy
+        self.maxsize = maxsize
+        self.queue: Optional[asyncio.Queue] = None
+        # every output is handed to each of these stages
+        self.next: List['Stage'] = []
+        self.dropped = 0
+        # a single thread keeps items in order and the handler free of concurrency
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'stage-{name}')
+
+    async def put(self, item):
+        if self.policy == DropPolicy.BLOCK:
+            await self.queue.put(item)
+            tracing.gauge('queue_depth', self.queue.qsize(), queue=self.name)
+            return
+
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                tracing.gauge('queue_depth', self.queue.qsize(), queue=self.name)
+                return
+            except asyncio.QueueFull:
+                if self.policy == DropPolicy.DROP_NEWEST:
+                    self._drop(item)
+                    return
+                try:
+                    self._drop(self.queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    pass
+
+    def _drop(self, item):
+        self.dropped += 1
+        tracing.count('dropped_total', queue=self.name)
+        logger.warning(f"[{self.name}] queue full, dropped an item ({self.dropped} dropped so far)")
+
+    async def _forward(self, output):
+        # handlers return None to stop an item from going further down the pipeline
+        if output is not None:
+            for stage in self.next:
+                await stage.put(output)
+
+    async def run(self, runtime: Runtime):
+        while True:
+            item = await self.queue.get()
+            tracing.gauge('queue_depth', self.queue.qsize(), queue=self.name)
+            if item is _STOP:
+                for stage in self.next:
+                    # the stop marker always waits for room so it is never dropped
+                    await stage.queue.put(_STOP)
+                self._executor.shutdown(wait=False)
+                return
+
+            try:
+                result = await runtime.run_blocking(self.handler, item, executor=self._executor)
+                if not isinstance(result, GeneratorType):
+                    await self._forward(result)
+                    continue
+                # generator handlers hand each result to the next stage as soon as it is yielded
+                while True:
+                    output = await runtime.run_blocking(next, result, _STOP, executor=self._executor)
+                    if output is _STOP:
+                        break
+                    await self._forward(output)
+            except Exception:
+                logger.exception(f"[{self.name}] failed to process item")
+
+
+class Pipeline:
+    """Chains stages so that every stage works on a different item at the same time.
+
+    Items that made it through `stages` are handed to every branch, each a chain of stages of its own running
+    side by side with the others, e.g. one per target language after a shared transcription.
+    """
+
+    def __init__(self, stages: List[Stage], branches: List[List[Stage]] = ()):
+        self.stages = stages
+        for chain in [stages, *branches]:
+            for stage, next_stage in zip(chain, chain[1:]):
+                stage.next = [next_stage]
+        stages[-1].next = [branch[0] for branch in branches if branch]
+        self.all_stages = stages + [stage for branch in branches for stage in branch]
+        self._running: Optional[asyncio.Future] = None
+
+    async def run(self, runtime: Runtime):
+        # queues are created here so they belong to the runtime's event loop
+        for stage in self.all_stages:
+            stage.queue = asyncio.Queue(stage.maxsize)
+        self._running = asyncio.gather(*(stage.run(runtime) for stage in self.all_stages))
+        await self._running
+
+    async def submit(self, item):
+        await self.stages[0].put(item)
+
+    async def close(self):
+        # let every queued item finish, returns once every stage's worker has exited
+        await self.stages[0].queue.put(_STOP)
+        await self._running
@@ -11,15 +11,18 @@ import os
 
 import numpy as np
 
+from .audio import PCM, wav_to_pcm
 from .downloader import download_thread
 import tarfile
 import zipfile
 import shutil
 
 import time
+from threading import Lock
 from os import getenv
 from pathlib import Path
 from dotenv import load_dotenv
+from . import tracing
 from .logger import logger
 
 import platform
@@ -31,9 +34,10 @@ load_dotenv()
 
 # Voicevox settings
 VOICE_ID = int(getenv('VOICE_ID'))
-TTS_WAV_PATH = Path(__file__).resolve(
-).parent.parent / 'audio' / r'tts.wav'
 VOICEVOX_ACCELERATION_MODE = getenv("VOICEVOX_ACCELERATION_MODE", "CPU")
+# version of the voicevox core downloaded below, part of the tts cache key
+VOICEVOX_CORE_VERSION = "0.14.3"
+VOICE_NAME = f"voicevox-{VOICEVOX_CORE_VERSION}/{VOICE_ID}"
 
 
 def load_module(package_dir):
@@ -206,87 +210,99 @@ open_jtalk_dict_file = {
 }
 
 
-print(f"[VOICEVOX] loading up voicevox core..")
-
 core = None
-acceleration_mode = VOICEVOX_ACCELERATION_MODE
 voicevox_core_module = None
-
-os.makedirs(Path(voicevox_plugin_dir / acceleration_mode), exist_ok=True)
-
-if not Path(voicevox_plugin_dir / acceleration_mode / "voicevox_core" / "__init__.py").is_file():
-    download_thread(voicevox_core_python_repository[OS][ARCH][acceleration_mode]["url"],
-                               str(Path(voicevox_plugin_dir / acceleration_mode).resolve()),
-                               voicevox_core_python_repository[OS][ARCH][acceleration_mode]["sha256"])
-    extract_zip(str(Path(voicevox_plugin_dir / acceleration_mode / os.path.basename(
-        voicevox_core_python_repository[OS][ARCH][acceleration_mode]["url"])).resolve()),
-                str(Path(voicevox_plugin_dir / acceleration_mode).resolve()))
-
-# if not Path(voicevox_plugin_dir / acceleration_mode / "voicevox_core" / "voicevox_core.lib").is_file():
-    download_thread(voicevox_core_dll_repository[OS][ARCH][acceleration_mode]["url"],
-                               str(Path(voicevox_plugin_dir / acceleration_mode).resolve()),
-                               voicevox_core_dll_repository[OS][ARCH][acceleration_mode]["sha256"])
-    extract_zip(str(Path(voicevox_plugin_dir / acceleration_mode / os.path.basename(
-        voicevox_core_dll_repository[OS][ARCH][acceleration_mode]["url"]))),
-                str(Path(voicevox_plugin_dir / acceleration_mode).resolve()))
-    # move dll files to voicevox_core directory
-    move_files(str(Path(
-        voicevox_plugin_dir / acceleration_mode / voicevox_core_dll_repository[OS][ARCH][acceleration_mode][
-            "path"]).resolve()),
-               str(Path(voicevox_plugin_dir / acceleration_mode / "voicevox_core").resolve()))
-    # delete folder
-    shutil.rmtree(Path(
-        voicevox_plugin_dir / acceleration_mode / voicevox_core_dll_repository[OS][ARCH][acceleration_mode][
-            "path"]))
-
-open_jtalk_dict_path = Path(voicevox_plugin_dir / open_jtalk_dict_file["path"])
-if not Path(open_jtalk_dict_path / "sys.dic").is_file():
-    download_thread(open_jtalk_dict_file["url"], str(voicevox_plugin_dir.resolve()),
-                               open_jtalk_dict_file["sha256"])
-    extract_tar_gz(str(voicevox_plugin_dir / os.path.basename(open_jtalk_dict_file["url"])),
-                   str(voicevox_plugin_dir.resolve()))
-
-
-# load the voicevox_core module
-if voicevox_core_module is None:
-    voicevox_core_module = load_module(
-        str(Path(voicevox_plugin_dir / acceleration_mode / "voicevox_core").resolve()))
-
-if core is None:
-    acceleration_mode = "AUTO"
-if acceleration_mode == "CPU":
-    acceleration_mode = voicevox_core_module.AccelerationMode.CPU
-elif acceleration_mode == "CUDA" or acceleration_mode == "GPU":
-    acceleration_mode = voicevox_core_module.AccelerationMode.GPU
-
-core = voicevox_core_module.VoicevoxCore(
-    acceleration_mode=acceleration_mode,
-    open_jtalk_dict_dir=str(open_jtalk_dict_path.resolve())
-)
-
-core.load_model(VOICE_ID)
-print(f"[VOICEVOX] successfully loaded! running on {'gpu' if core.is_gpu_mode else 'cpu'}")
-
-def tts_generate_wav_jp(sentence: str):
+_load_lock = Lock()
+
+
+def load():
+    # downloads voicevox core and loads the voice model once
+    global core, voicevox_core_module
+    with _load_lock:
+        if core is not None:
+            return core
+
+        print(f"[VOICEVOX] loading up voicevox core..")
+        acceleration_mode = VOICEVOX_ACCELERATION_MODE
+
+        os.makedirs(Path(voicevox_plugin_dir / acceleration_mode), exist_ok=True)
+
+        if not Path(voicevox_plugin_dir / acceleration_mode / "voicevox_core" / "__init__.py").is_file():
+            download_thread(voicevox_core_python_repository[OS][ARCH][acceleration_mode]["url"],
+                                       str(Path(voicevox_plugin_dir / acceleration_mode).resolve()),
+                                       voicevox_core_python_repository[OS][ARCH][acceleration_mode]["sha256"])
+            extract_zip(str(Path(voicevox_plugin_dir / acceleration_mode / os.path.basename(
+                voicevox_core_python_repository[OS][ARCH][acceleration_mode]["url"])).resolve()),
+                        str(Path(voicevox_plugin_dir / acceleration_mode).resolve()))
+
+        # if not Path(voicevox_plugin_dir / acceleration_mode / "voicevox_core" / "voicevox_core.lib").is_file():
+            download_thread(voicevox_core_dll_repository[OS][ARCH][acceleration_mode]["url"],
+                                       str(Path(voicevox_plugin_dir / acceleration_mode).resolve()),
+                                       voicevox_core_dll_repository[OS][ARCH][acceleration_mode]["sha256"])
+            extract_zip(str(Path(voicevox_plugin_dir / acceleration_mode / os.path.basename(
+                voicevox_core_dll_repository[OS][ARCH][acceleration_mode]["url"]))),
+                        str(Path(voicevox_plugin_dir / acceleration_mode).resolve()))
+            # move dll files to voicevox_core directory
+            move_files(str(Path(
+                voicevox_plugin_dir / acceleration_mode / voicevox_core_dll_repository[OS][ARCH][acceleration_mode][
+                    "path"]).resolve()),
+                       str(Path(voicevox_plugin_dir / acceleration_mode / "voicevox_core").resolve()))
+            # delete folder
+            shutil.rmtree(Path(
+                voicevox_plugin_dir / acceleration_mode / voicevox_core_dll_repository[OS][ARCH][acceleration_mode][
+                    "path"]))
+
+        open_jtalk_dict_path = Path(voicevox_plugin_dir / open_jtalk_dict_file["path"])
+        if not Path(open_jtalk_dict_path / "sys.dic").is_file():
+            download_thread(open_jtalk_dict_file["url"], str(voicevox_plugin_dir.resolve()),
+                                       open_jtalk_dict_file["sha256"])
+            extract_tar_gz(str(voicevox_plugin_dir / os.path.basename(open_jtalk_dict_file["url"])),
+                           str(voicevox_plugin_dir.resolve()))
+
+        # load the voicevox_core module
+        if voicevox_core_module is None:
+            voicevox_core_module = load_module(
+                str(Path(voicevox_plugin_dir / acceleration_mode / "voicevox_core").resolve()))
+
+        if core is None:
+            acceleration_mode = "AUTO"
+        if acceleration_mode == "CPU":
+            acceleration_mode = voicevox_core_module.AccelerationMode.CPU
+        elif acceleration_mode == "CUDA" or acceleration_mode == "GPU":
+            acceleration_mode = voicevox_core_module.AccelerationMode.GPU
+
+        core = voicevox_core_module.VoicevoxCore(
+            acceleration_mode=acceleration_mode,
+            open_jtalk_dict_dir=str(open_jtalk_dict_path.resolve())
+        )
+
+        core.load_model(VOICE_ID)
+        print(f"[VOICEVOX] successfully loaded! running on {'gpu' if core.is_gpu_mode else 'cpu'}")
+        return core
+
+
+def tts_generate_wav_jp(sentence: str) -> PCM:
     start = time.time()
 
     if len(sentence.strip()) == 0:
         logger.debug("empty sentence")
-        wav = np.zeros(0).astype(np.int16)
-        TTS_WAV_PATH.write_bytes(wav)
-        return
+        return PCM(np.zeros((0, 2), dtype=np.int16), 24000)
+
+    core = load()
 
     logger.debug("querying voicevox")
-    audio_query = core.audio_query(sentence, VOICE_ID)
+    with tracing.span('voicevox_query', characters=len(sentence)):
+        audio_query = core.audio_query(sentence, VOICE_ID)
     audio_query.output_stereo = True
     logger.debug(f"querying took: {time.time() - start}")
 
     logger.debug("synthesis starting")
-    wav = core.synthesis(audio_query, VOICE_ID)
+    with tracing.span('voicevox_synthesis', characters=len(sentence)):
+        wav = core.synthesis(audio_query, VOICE_ID)
     logger.debug(f"synthesis took: {time.time() - start}")
 
-    TTS_WAV_PATH.write_bytes(wav)
-    logger.debug(f"wrote to wav file took: {time.time() - start}")
+    # the returned samples are a view over voicevox's wav bytes, nothing is written to disk
+    return wav_to_pcm(wav)
 
 
 if __name__ == '__main__':
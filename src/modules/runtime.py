@@ -0,0 +1,84 @@
+import asyncio
+from collections import defaultdict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from os import getenv
+from threading import Thread
+from typing import Callable, Coroutine, Optional
+
+from dotenv import load_dotenv
+
+from .logger import logger
+
+load_dotenv()
+
+# threads running blocking calls (model inference, network requests) for the event loop
+RUNTIME_WORKERS = int(getenv('RUNTIME_WORKERS', 4))
+
+
+class Runtime:
+    """asyncio event loop that keyboard, audio and pipeline threads post their events to."""
+
+    def __init__(self, workers: int = RUNTIME_WORKERS):
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='runtime')
+        self._handlers = defaultdict(list)
+
+    def on(self, event: str, handler: Callable):
+        # handlers run on the event loop, coroutine functions are scheduled as tasks
+        self._handlers[event].append(handler)
+
+    def post(self, event: str, *args):
+        # safe to call from any thread
+        self.loop.call_soon_threadsafe(self._dispatch, event, args)
+
+    def _dispatch(self, event: str, args: tuple):
+        for handler in self._handlers[event]:
+            try:
+                result = handler(*args)
+            except Exception:
+                logger.exception(f"handler for {event} failed")
+                continue
+            if asyncio.iscoroutine(result):
+                self.spawn(result)
+
+    def spawn(self, coroutine: Coroutine) -> asyncio.Task:
+        task = self.loop.create_task(coroutine)
+        task.add_done_callback(self._report)
+        return task
+
+    @staticmethod
+    def _report(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("task failed", exc_info=task.exception())
+
+    async def run_blocking(self, function: Callable, *args, executor: Optional[Executor] = None):
+        # keeps the loop responsive while models and network calls block a worker thread
+        return await self.loop.run_in_executor(executor or self.executor, function, *args)
+
+    def call(self, coroutine: Coroutine):
+        # runs a coroutine on the loop from any other thread and waits for its result
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def finish(self, coroutine: Coroutine):
+        # runs a coroutine to the end on shutdown, whether the loop still runs on its thread or was stopped by ctrl+c
+        if self.loop.is_running():
+            return self.call(coroutine)
+        return self.loop.run_until_complete(coroutine)
+
+    def run(self, main: Optional[Coroutine] = None):
+        asyncio.set_event_loop(self.loop)
+        if main is not None:
+            self.spawn(main)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.executor.shutdown(wait=False)
+
+    def start_in_thread(self, main: Optional[Coroutine] = None) -> Thread:
+        # for when the main thread is needed by something else, e.g. tkinter's mainloop
+        thread = Thread(target=self.run, args=[main], name='runtime', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
@@ -0,0 +1,39 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict
+
+from .logger import logger
+
+
+def warm_up(components: Dict[str, Callable]) -> Dict[str, dict]:
+    """Load every component concurrently so start up takes as long as the slowest one instead of all of them."""
+    start = time.time()
+    report = {}
+
+    def timed(load):
+        component_start = time.time()
+        load()
+        return time.time() - component_start
+
+    with ThreadPoolExecutor(max_workers=len(components), thread_name_prefix='warm-up') as pool:
+        futures = {pool.submit(timed, load): name for name, load in components.items()}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                took = future.result()
+            except Exception as e:
+                logger.exception(f"[STARTUP] {name} failed to load")
+                report[name] = {"ready": False, "seconds": time.time() - start, "error": repr(e)}
+            else:
+                logger.info(f"[STARTUP] {name} ready | took {took:.2f}s")
+                report[name] = {"ready": True, "seconds": took}
+
+    total = time.time() - start
+    sequential = sum(component["seconds"] for component in report.values())
+    logger.info(f"[STARTUP] {len(report)} components loaded in {total:.2f}s "
+                f"(one after another would have taken {sequential:.2f}s)")
+
+    failed = [name for name, component in report.items() if not component["ready"]]
+    if failed:
+        raise RuntimeError(f"failed to load: {', '.join(failed)}")
+    return report
@@ -0,0 +1,135 @@
+import time
+from os import getenv
+from threading import Event, Lock, Thread
+
+import numpy as np
+from dotenv import load_dotenv
+
+from .audio import WHISPER_SAMPLE_RATE
+from .logger import logger
+from .transcription import get_model, transcribe_options
+
+load_dotenv()
+
+STREAMING_TRANSCRIPTION = getenv('STREAMING_TRANSCRIPTION', 'False').lower() in ('true', '1', 't')
+# seconds between two decodes of the rolling window while the record key is held
+STREAM_INTERVAL = float(getenv('STREAM_INTERVAL', 1.0))
+# segments ending closer than this to the end of the window may still change and are not committed
+STREAM_STABLE_MARGIN = float(getenv('STREAM_STABLE_MARGIN', 1.5))
+# whisper only looks at the last 224 prompt tokens, there is no point in passing more committed text
+PROMPT_CHARS = 200
+
+
+class IncrementalDecoder:
+    """Commits stable whisper segments so that only the unstable tail of the audio is decoded again."""
+
+    def __init__(self, stable_margin: float = STREAM_STABLE_MARGIN, language: str = None, task: str = 'transcribe'):
+        # language is the expected spoken language, used when the whisper profile forces it
+        # task='translate' decodes straight to english text, see translation.speech_task
+        self.stable_margin = stable_margin
+        self.language_hint = language
+        self.task = task
+        self.committed_text = ''
+        self.committed_seconds = 0.0
+        self.language = None
+
+    def reset(self):
+        self.committed_text = ''
+        self.committed_seconds = 0.0
+        self.language = None
+
+    def skip_to(self, seconds: float):
+        # audio before `seconds` is no longer available, continue decoding from there
+        self.committed_seconds = max(self.committed_seconds, seconds)
+
+    def decode(self, tail: np.ndarray, final: bool = False) -> str:
+        # tail is 16kHz mono audio starting at self.committed_seconds
+        if len(tail) == 0:
+            return self.committed_text
+
+        options = transcribe_options(self.language_hint, task=self.task,
+                                     initial_prompt=self.committed_text[-PROMPT_CHARS:] or None)
+        if self.language is not None:
+            # once detected, the language is kept for the rest of the utterance
+            options["language"] = self.language
+        segments, info = get_model().transcribe(tail, **options)
+        if self.language is None:
+            self.language = info.language
+
+        tail_seconds = len(tail) / WHISPER_SAMPLE_RATE
+        committing = True
+        committed_end = 0.0
+        pending = []
+        for segment in segments:
+            # only a contiguous prefix of stable segments can be committed
+            committing = committing and (final or segment.end < tail_seconds - self.stable_margin)
+            if committing:
+                self.committed_text += segment.text
+                committed_end = segment.end
+            else:
+                pending.append(segment.text)
+
+        self.committed_seconds += committed_end
+        return self.committed_text + ''.join(pending)
+
+
+class StreamingTranscriber:
+    """Transcribes a recording in a background thread while it is still being recorded."""
+
+    def __init__(self, audio_buffer, interval: float = STREAM_INTERVAL, language: str = None,
+                 task: str = 'transcribe'):
+        # audio_buffer is anything with len(), sample_rate and to_whisper(start), e.g. a Recording
+        self.audio_buffer = audio_buffer
+        self.interval = interval
+        self.decoder = IncrementalDecoder(language=language, task=task)
+        self._stop = Event()
+        self._lock = Lock()
+        self._thread = None
+        self._decoded_length = 0
+
+    def start(self):
+        self.decoder.reset()
+        self._stop.clear()
+        self._decoded_length = 0
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _tail(self) -> np.ndarray:
+        start = int(self.decoder.committed_seconds * self.audio_buffer.sample_rate)
+        return self.audio_buffer.to_whisper(start)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            length = len(self.audio_buffer)
+            if length == self._decoded_length:
+                continue
+            with self._lock:
+                start = time.time()
+                text = self.decoder.decode(self._tail())
+                self._decoded_length = length
+            logger.debug(f"partial transcript: {text} | committed {self.decoder.committed_seconds:.2f}s "
+                         f"| took {time.time() - start}")
+
+    def _stop_worker(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def finish(self) -> dict:
+        # stop the worker, then decode whatever has not been committed yet
+        self._stop_worker()
+        with self._lock:
+            text = self.decoder.decode(self._tail(), final=True)
+        return {"text": text, "language": self.decoder.language}
+
+    def finish_segments(self):
+        # like finish(), but the text committed while recording is handed out before the tail is decoded
+        self._stop_worker()
+        with self._lock:
+            committed = self.decoder.committed_text
+            if committed.strip():
+                yield {"text": committed, "language": self.decoder.language}
+            text = self.decoder.decode(self._tail(), final=True)
+        if text[len(committed):].strip():
+            yield {"text": text[len(committed):], "language": self.decoder.language}
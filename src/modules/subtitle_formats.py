@@ -0,0 +1,29 @@
+from pathlib import Path
+from typing import Iterable, Tuple
+
+# (start seconds, end seconds, text)
+Cue = Tuple[float, float, str]
+
+
+def format_timestamp(seconds: float, separator: str) -> str:
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3_600_000)
+    minutes, milliseconds = divmod(milliseconds, 60_000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f'{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{milliseconds:03d}'
+
+
+def write_srt(path: Path, cues: Iterable[Cue]):
+    with open(path, 'w', encoding='utf-8') as f:
+        for index, (start, end, text) in enumerate(cues, start=1):
+            f.write(f'{index}\n{format_timestamp(start, ",")} --> {format_timestamp(end, ",")}\n{text.strip()}\n\n')
+
+
+def write_vtt(path: Path, cues: Iterable[Cue]):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('WEBVTT\n\n')
+        for start, end, text in cues:
+            f.write(f'{format_timestamp(start, ".")} --> {format_timestamp(end, ".")}\n{text.strip()}\n\n')
+
+
+WRITERS = {'srt': write_srt, 'vtt': write_vtt}
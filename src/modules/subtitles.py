@@ -0,0 +1,72 @@
+import textwrap
+from collections import OrderedDict
+from os import getenv
+from typing import List, NamedTuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# lines of subtitles on screen, finished phrases scroll up and out of view as new ones arrive
+SUBTITLE_HISTORY_LINES = int(getenv('SUBTITLE_HISTORY_LINES', 3))
+# characters per line before wrapping
+LINE_WIDTH = 64
+
+
+class SubtitleUpdate(NamedTuple):
+    phrase_id: int
+    text: str
+    # partial hypotheses of a phrase are replaced by every newer one, a final one no longer changes
+    final: bool = False
+
+
+class SubtitleHistory:
+    """The text of the last few phrases, where the phrase still being spoken is updated in place."""
+
+    def __init__(self, max_lines: int = SUBTITLE_HISTORY_LINES, width: int = LINE_WIDTH):
+        self.max_lines = max_lines
+        self.width = width
+        # phrase id -> wrapped lines, oldest phrase first
+        self._phrases = OrderedDict()
+        self._final = set()
+        # phrases up to this id scrolled out of view or were cleared, late results for them are ignored
+        self._floor = -1
+
+    def update(self, update: SubtitleUpdate) -> bool:
+        """Apply an update, returns False when it changed nothing."""
+        if update.phrase_id in self._final or update.phrase_id <= self._floor:
+            return False
+
+        lines = textwrap.wrap(update.text, self.width)
+        if update.final:
+            self._final.add(update.phrase_id)
+        if self._phrases.get(update.phrase_id) == lines:
+            return False
+        self._phrases[update.phrase_id] = lines
+        # keep phrases in spoken order even if a newer one was decoded first
+        for phrase_id in sorted(self._phrases):
+            self._phrases.move_to_end(phrase_id)
+        self._trim()
+        return True
+
+    def _trim(self):
+        # drop phrases that no longer have a single line on screen
+        while len(self._phrases) > 1 and sum(map(len, self._phrases.values())) - len(
+                next(iter(self._phrases.values()))) >= self.max_lines:
+            phrase_id, _ = self._phrases.popitem(last=False)
+            self._final.discard(phrase_id)
+            self._floor = max(self._floor, phrase_id)
+
+    def lines(self) -> List[str]:
+        lines = [line for phrase in self._phrases.values() for line in phrase]
+        return lines[-self.max_lines:]
+
+    def clear(self):
+        # takes everything off screen, but a phrase still being spoken keeps taking updates and shows up with the next one,
+        # only finished phrases before it are closed for good
+        still_open = [phrase_id for phrase_id in self._phrases if phrase_id not in self._final]
+        done = [phrase_id for phrase_id in self._final if not still_open or phrase_id < min(still_open)]
+        if done:
+            self._floor = max(self._floor, max(done))
+        self._final.difference_update(done)
+        self._phrases.clear()
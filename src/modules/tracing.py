@@ -0,0 +1,259 @@
+import json
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import getenv
+from queue import Queue
+from threading import Lock, Thread
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from .logger import logger
+
+load_dotenv()
+
+TRACING = getenv('TRACING', 'False').lower() in ('true', '1', 't')
+# every span is appended to this file as one json object per line
+TRACE_FILE = getenv('TRACE_FILE')
+# serves the latency histograms as prometheus text on http://host:METRICS_PORT/metrics, 0 turns it off
+METRICS_PORT = int(getenv('METRICS_PORT', 0))
+# added to every span and metric so traces from many instances can be told apart
+INSTANCE_NAME = getenv('INSTANCE_NAME') or socket.gethostname()
+
+# seconds, from cheap stages such as vad up to whisper on long recordings
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# processing time divided by audio length, below 1 is faster than real time
+RTF_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 4.0)
+
+
+class Histogram:
+    """Cumulative bucket counts like prometheus histograms, so they can be summed across instances."""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+def _labels(labels: dict) -> str:
+    labels = {"instance": INSTANCE_NAME, **labels}
+    return ','.join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+
+
+class Metrics:
+    """Latency and real time factor histograms per stage plus gauges, rendered in prometheus' text format."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._histograms: Dict[Tuple[str, str], Histogram] = {}
+        self._gauges: Dict[Tuple[str, str], float] = {}
+        self._counters: Dict[Tuple[str, str], float] = {}
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = LATENCY_BUCKETS, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[(name, _labels(labels))] = value
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def render(self) -> str:
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                declare(name, 'histogram')
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+                lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+            for (name, labels), value in sorted(self._gauges.items()):
+                declare(name, 'gauge')
+                lines.append(f'{name}{{{labels}}} {value}')
+            for (name, labels), value in sorted(self._counters.items()):
+                declare(name, 'counter')
+                lines.append(f'{name}{{{labels}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+# spans waiting to be written to TRACE_FILE, the writer thread does the file io
+_records: Optional[Queue] = None
+_current = ContextVar('trace', default=None)
+_started = False
+_start_lock = Lock()
+
+
+class Trace:
+    """One utterance or subtitle request, every span recorded while it is active carries its id."""
+
+    def __init__(self, **attrs):
+        self.id = uuid.uuid4().hex[:16]
+        self.created = time.time()
+        self.attrs = attrs
+        self._marked = set()
+        self._branches = {}
+        self._branch_lock = Lock()
+
+    def branch(self, **attrs) -> 'Trace':
+        # the same utterance going down one of several parallel paths, e.g. one per target language,
+        # every segment on the same path gets the same branch so mark(once=True) fires once per path
+        key = tuple(sorted(attrs.items()))
+        with self._branch_lock:
+            branch = self._branches.get(key)
+            if branch is None:
+                branch = self._branches[key] = Trace(**self.attrs, **attrs)
+                branch.id = self.id
+                branch.created = self.created
+            return branch
+
+    @contextmanager
+    def activate(self):
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def mark(self, name: str, once: bool = False, **attrs):
+        # time since the trace started, e.g. from key release until the first audio is played
+        if once:
+            if name in self._marked:
+                return
+            self._marked.add(name)
+        record(name, time.time() - self.created, trace=self, **attrs)
+
+
+def start_trace(**attrs) -> Trace:
+    return Trace(**attrs)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def record(name: str, duration: float, audio_seconds: float = None, trace: Trace = None, **attrs):
+    """Record a finished span, audio_seconds adds its real time factor."""
+    if not TRACING:
+        return
+    trace = trace or _current.get()
+    metrics.observe('stage_duration_seconds', duration, stage=name)
+    rtf = None
+    if audio_seconds:
+        rtf = duration / audio_seconds
+        metrics.observe('stage_real_time_factor', rtf, RTF_BUCKETS, stage=name)
+
+    if _records is not None:
+        _records.put({
+            "trace": trace.id if trace else None,
+            "span": name,
+            "instance": INSTANCE_NAME,
+            "end": time.time(),
+            "duration": duration,
+            "audio_seconds": audio_seconds,
+            "rtf": rtf,
+            **(trace.attrs if trace else {}),
+            **attrs,
+        })
+
+
+class Span:
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        # for values only known once the work is done, such as the length of synthesized audio
+        self.attrs.update(attrs)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time the block as a span of the active trace."""
+    current = Span(name, attrs)
+    start = time.time()
+    try:
+        yield current
+    finally:
+        record(name, time.time() - start, **current.attrs)
+
+
+def gauge(name: str, value: float, **labels):
+    if TRACING:
+        metrics.set(name, value, **labels)
+
+
+def count(name: str, value: float = 1, **labels):
+    if TRACING:
+        metrics.inc(name, value, **labels)
+
+
+def _write_records(path: str):
+    with open(path, 'a', encoding='utf-8') as file:
+        while True:
+            entry = _records.get()
+            file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            # flush whenever the queue runs dry, so a crash loses at most the spans of one burst
+            if _records.empty():
+                file.flush()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip('/') not in ('', '/metrics'):
+            self.send_error(404)
+            return
+        body = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start():
+    """Start the exporters configured in .env, does nothing unless TRACING is set."""
+    global _records, _started
+    with _start_lock:
+        if not TRACING or _started:
+            return
+        _started = True
+        if TRACE_FILE:
+            _records = Queue()
+            Thread(target=_write_records, args=[TRACE_FILE], name='trace-writer', daemon=True).start()
+            logger.info(f"[TRACING] writing spans to {TRACE_FILE}")
+        if METRICS_PORT:
+            server = ThreadingHTTPServer(('', METRICS_PORT), _MetricsHandler)
+            Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+            logger.info(f"[TRACING] serving metrics on port {METRICS_PORT}")
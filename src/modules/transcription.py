@@ -1,35 +1,126 @@
-from os import getenv
+import time
+from os import cpu_count, getenv
 from pathlib import Path
+from threading import Lock
 import torch.cuda
 from faster_whisper import WhisperModel
 from dotenv import load_dotenv
+from . import tracing
+from .audio import WHISPER_SAMPLE_RATE
 
 
 load_dotenv()
 
 WHISPER_MODEL = getenv('WHISPER_MODEL', "small.en")
+
+# named inference settings, `model` options are used when the model is created and `transcribe` options on every call
+WHISPER_PROFILES = {
+    # greedy decoding, no temperature fallback, silence skipped and the configured language forced
+    'realtime': {
+        # greedy decoding of short utterances gains little from more threads, the rest are left to tts and the game
+        "model": {"cpu_threads": 2, "num_workers": 1},
+        "transcribe": {"beam_size": 1, "best_of": 1, "temperature": 0.0, "vad_filter": True,
+                       "condition_on_previous_text": False, "word_timestamps": False},
+        "force_language": True,
+    },
+    # a small beam and some fallback, the language is still detected so nobody is decoded in the wrong one
+    'balanced': {
+        "model": {"cpu_threads": 4, "num_workers": 1},
+        "transcribe": {"beam_size": 2, "best_of": 2, "temperature": [0.0, 0.4, 0.8], "vad_filter": True,
+                       "condition_on_previous_text": True, "word_timestamps": False},
+        "force_language": False,
+    },
+    # faster-whisper's default beam search and temperature fallback plus word timestamps, detecting the language
+    'accurate': {
+        # a beam of 5 keeps every core busy
+        "model": {"cpu_threads": cpu_count() or 4, "num_workers": 1},
+        "transcribe": {"beam_size": 5, "best_of": 5, "temperature": [0.0, 0.2, 0.4, 0.6, 0.8, 1.0],
+                       "vad_filter": False, "condition_on_previous_text": True, "word_timestamps": True},
+        "force_language": False,
+    },
+}
+WHISPER_PROFILE = getenv('WHISPER_PROFILE', 'balanced')
+assert WHISPER_PROFILE in WHISPER_PROFILES, f"WHISPER_PROFILE must be one of {', '.join(WHISPER_PROFILES)}"
+# overrides the profile's thread count, 0 lets ctranslate2 decide
+WHISPER_CPU_THREADS = getenv('WHISPER_CPU_THREADS')
 SAMPLE_JP_FILEPATH = Path(__file__).resolve(
 ).parent.parent / r'audio' / 'samples' / 'japanese_speech_sample.wav'
-SAMPLE_EN_FILEPATH = Path(__file__).resolve(
-).parent.parent / 'audio' / 'samples' / 'english_speech_sample.wav'
 
-print(f"[WHISPER] loading up {WHISPER_MODEL} whisper model..")
-model = WhisperModel(WHISPER_MODEL, device="cuda" if torch.cuda.is_available() else "cpu", compute_type="float16" if torch.cuda.is_available() else "int8")
-segments, _ = model.transcribe(str(SAMPLE_EN_FILEPATH.resolve()))
-_ = list(segments)
-del segments
-print(f"[WHISPER] successfully loaded! running on {model.model.device}")
+model = None
+_load_lock = Lock()
+
+
+def create_model(model_name: str = WHISPER_MODEL, profile: str = WHISPER_PROFILE, device: str = None,
+                 **overrides) -> WhisperModel:
+    options = dict(WHISPER_PROFILES[profile]["model"])
+    if WHISPER_CPU_THREADS:
+        options["cpu_threads"] = int(WHISPER_CPU_THREADS)
+    options.update(overrides)
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    return WhisperModel(model_name, device=device, compute_type="float16" if device == "cuda" else "int8", **options)
+
+
+def transcribe_options(language: str = None, profile: str = WHISPER_PROFILE, **overrides) -> dict:
+    # language is the spoken language if one was configured, profiles that force it skip whisper's language detection
+    settings = WHISPER_PROFILES[profile]
+    options = dict(settings["transcribe"])
+    if language and settings["force_language"]:
+        options["language"] = language
+    options.update(overrides)
+    return options
+
+
+def load():
+    # loads and warms up the model once, the subtitler's workers may ask for it at the same time as warm_up
+    global model
+    with _load_lock:
+        if model is not None:
+            return model
+
+        print(f"[WHISPER] loading up {WHISPER_MODEL} whisper model with the {WHISPER_PROFILE} profile..")
+        whisper = create_model(WHISPER_MODEL, WHISPER_PROFILE)
+        segments, _ = whisper.transcribe(str(SAMPLE_JP_FILEPATH.resolve()), **transcribe_options())
+        _ = list(segments)
+        del segments
+        model = whisper
+        print(f"[WHISPER] successfully loaded! running on {model.model.device}")
+        return model
+
+
+def get_model():
+    return model if model is not None else load()
+
+
+def audio_seconds(audio):
+    # length of in-memory audio, None for files
+    return None if isinstance(audio, str) else len(audio) / WHISPER_SAMPLE_RATE
+
+
+def transcribe(audio, language: str = None, task: str = 'transcribe'):
+    # audio is either a path to an audio file or a 16kHz mono float32 numpy array
+    # task='translate' makes whisper write english text whatever the spoken language is
+    with tracing.span('whisper', audio_seconds=audio_seconds(audio), profile=WHISPER_PROFILE, task=task) as span:
+        segments, info = get_model().transcribe(audio, **transcribe_options(language, task=task))
+        # segments = list(segments)
+        text = "".join(map(lambda x: x.text, segments))
+        span.set(language=info.language)
+    return {"text": text, "language": info.language}
 
 
-def transcribe(filepath):
-    segments, info = model.transcribe(filepath)
-    # segments = list(segments)
-    return {"text": "".join(map(lambda x: x.text, segments)), "language": info.language}
+def transcribe_segments(audio, language: str = None, task: str = 'transcribe'):
+    # whisper decodes lazily, so each segment is yielded as soon as it is decoded and the next one is not started
+    # until it is asked for, letting translation and tts work on segment 1 while segments 2..N are decoded
+    start = time.time()
+    segments, info = get_model().transcribe(audio, **transcribe_options(language, task=task))
+    for segment in segments:
+        # the time spent in whisper for this segment, not counting the consumer's work between segments
+        tracing.record('whisper', time.time() - start, audio_seconds=segment.end - segment.start,
+                       profile=WHISPER_PROFILE, language=info.language, task=task)
+        yield {"text": segment.text, "language": info.language, "start": segment.start, "end": segment.end}
+        start = time.time()
 
 
 if __name__ == '__main__':
-    # test if whisper is up and running
-    print('Testing Whisper on English speech sample.')
-    print(f'Actual audio: Oh. Honestly, I could not be bothered to play this game to full completion.'
-          f'The narrator is obnoxious and unfunny, with his humor and dialogue proving to be more irritating than '
-          f'entertaining.\nWhisper audio: {transcribe(str(SAMPLE_EN_FILEPATH.resolve()))}\n')
+    # test if whisper is up and running, needs a multilingual model (no .en suffix)
+    print('Testing Whisper on Japanese speech sample.')
+    print(f'Whisper audio: {transcribe(str(SAMPLE_JP_FILEPATH.resolve()), "ja")}\n')
@@ -0,0 +1,75 @@
+import time
+from collections import OrderedDict
+from os import getenv
+from threading import Condition, Thread
+from typing import Callable, Hashable
+
+from dotenv import load_dotenv
+
+from . import tracing
+from .logger import logger
+
+load_dotenv()
+
+# number of requests decoded at the same time, they all share one whisper model
+TRANSCRIPTION_WORKERS = int(getenv('TRANSCRIPTION_WORKERS', 1))
+# requests waiting longer than this are dropped instead of showing an outdated subtitle
+REQUEST_TIMEOUT = float(getenv('REQUEST_TIMEOUT', 4))
+
+
+class TranscriptionPool:
+    """Fixed set of workers with at most one pending request per phrase, newer audio replaces older audio."""
+
+    def __init__(self, handler: Callable, workers: int = TRANSCRIPTION_WORKERS, timeout: float = REQUEST_TIMEOUT):
+        self.handler = handler
+        self.timeout = timeout
+        self.coalesced = 0
+        self.expired = 0
+        self._pending = OrderedDict()
+        self._busy = set()
+        self._condition = Condition()
+        self._workers = [Thread(target=self._run, name=f'transcriber-{i}', daemon=True) for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, phrase_id: Hashable, payload, created: float = None):
+        with self._condition:
+            if phrase_id in self._pending:
+                # the newer window contains everything the older one did, only decode that one
+                self.coalesced += 1
+            self._pending[phrase_id] = (payload, created if created is not None else time.time())
+            tracing.gauge('queue_depth', len(self._pending), queue='transcription')
+            self._condition.notify()
+
+    def _next(self):
+        # oldest phrase first, but never two requests of the same phrase at once so results stay in order
+        for phrase_id in self._pending:
+            if phrase_id not in self._busy:
+                payload, created = self._pending.pop(phrase_id)
+                self._busy.add(phrase_id)
+                return phrase_id, payload, created
+        return None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                request = self._next()
+                while request is None:
+                    self._condition.wait()
+                    request = self._next()
+
+            phrase_id, payload, created = request
+            try:
+                if time.time() - created > self.timeout:
+                    self.expired += 1
+                    tracing.count('dropped_total', queue='transcription')
+                    logger.debug(f"dropped request for phrase {phrase_id}, waited more than {self.timeout}s")
+                else:
+                    self.handler(phrase_id, payload, created)
+            except Exception:
+                logger.exception(f"failed to process phrase {phrase_id}")
+            finally:
+                with self._condition:
+                    self._busy.discard(phrase_id)
+                    # a newer window of this phrase may have been waiting for us
+                    self._condition.notify()
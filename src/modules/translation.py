@@ -1,6 +1,16 @@
 from dotenv import load_dotenv
 from os import getenv
+import time
+from concurrent.futures import Future
 from enum import Enum
+from queue import Empty, Queue
+from threading import Lock, Thread
+from typing import List
+from . import tracing
+from .languages import TARGET_LANGUAGE_CODES
+from .logger import logger
+from .translation_cache import TRANSLATION_CACHE_SIZE, TRANSLATION_CACHE_TTL, TranslationCache, translation_key
+from .translation_client import DeepLClient, GoogleClient, TranslationError
 
 load_dotenv()
 
@@ -16,47 +26,296 @@ TRANSLATION_BACKEND: TranslationBackend = TranslationBackend[
     getenv('TRANSLATION_BACKEND', TranslationBackend.ARGO)]  # 'ARGO' | 'DEEPL' | 'GOOGL' | 'WHISPER'
 assert TRANSLATION_BACKEND in [TranslationBackend.ARGO, TranslationBackend.DEEPL, TranslationBackend.GOOGLE,
                                TranslationBackend.WHISPER]
-TARGET_LANGUAGE_CODE = getenv('TARGET_LANGUAGE_CODE')
+# language you speak in, used to pick the argos package to install at start up
+SOURCE_LANGUAGE_CODE = getenv('SOURCE_LANGUAGE_CODE', 'en')
 DEEPL_AUTH_KEY = getenv('DEEPL_AUTH_KEY')
+# max number of texts sent to the backend in one call
+TRANSLATION_BATCH_SIZE = int(getenv('TRANSLATION_BATCH_SIZE', 32))
+# how long BatchTranslator waits for more texts before sending a batch
+TRANSLATION_BATCH_LATENCY_MS = float(getenv('TRANSLATION_BATCH_LATENCY_MS', 50))
+# deepl needs a regional variant for these target languages
+DEEPL_TARGET_LANGUAGES = {'en': 'EN-US', 'pt': 'PT-BR'}
+# talk to deepl and google through translation_client's pooled, retrying client instead of their python libraries
+TRANSLATION_HTTP_CLIENT = getenv('TRANSLATION_HTTP_CLIENT', 'True').lower() in ('true', '1', 't')
+# base urls of the apis, e.g. to point them at a local stub server
+DEEPL_API_URL = getenv('DEEPL_API_URL') or None
+GOOGLE_TRANSLATE_URL = getenv('GOOGLE_TRANSLATE_URL') or None
+# translate locally with argos while deepl or google are failing, leave empty to fail instead
+TRANSLATION_FALLBACK = getenv('TRANSLATION_FALLBACK', 'ARGO')
 
-if TRANSLATION_BACKEND == TranslationBackend.ARGO:
-    import argostranslate.package
+google_translator = None
+deepl_translator = None
+http_client = None
+argos_fallback = False
+_loaded = False
+_load_lock = Lock()
+
+
+def load(to_codes: List[str] = None, from_code: str = SOURCE_LANGUAGE_CODE):
+    # sets up the translation backend
+    # at start up, to_codes are the languages the app translates to from from_code, so a backend or argos package that
+    # cannot translate them fails there instead of on every utterance
+    global google_translator, deepl_translator, http_client, argos_fallback, _loaded
+    if TRANSLATION_BACKEND == TranslationBackend.WHISPER:
+        _check_whisper(to_codes)
+    with _load_lock:
+        if _loaded:
+            # set up by another part of the app, e.g. the voice translator running the subtitler, which may need
+            # other argos packages
+            if to_codes is not None and (TRANSLATION_BACKEND == TranslationBackend.ARGO or argos_fallback):
+                _ensure_argos_packages(from_code, to_codes)
+            return
+
+        if TRANSLATION_BACKEND == TranslationBackend.ARGO:
+            _load_argos(from_code, to_codes or TARGET_LANGUAGE_CODES)
+
+        elif TRANSLATION_BACKEND == TranslationBackend.GOOGLE:
+            if TRANSLATION_HTTP_CLIENT:
+                http_client = GoogleClient(GOOGLE_TRANSLATE_URL)
+            else:
+                import googletrans
+
+                google_translator = googletrans.Translator()
+
+        elif TRANSLATION_BACKEND == TranslationBackend.DEEPL:
+            if TRANSLATION_HTTP_CLIENT:
+                http_client = DeepLClient(DEEPL_AUTH_KEY, DEEPL_API_URL)
+            else:
+                import deepl
+
+                deepl_translator = deepl.Translator(DEEPL_AUTH_KEY)
+
+        if http_client is not None and TRANSLATION_FALLBACK == 'ARGO':
+            # installed now, so an outage is not the moment argos starts downloading packages
+            try:
+                _load_argos(from_code, to_codes or TARGET_LANGUAGE_CODES)
+                argos_fallback = True
+            except Exception:
+                logger.exception("argos could not be loaded, translations will fail while the online api does")
+
+        _loaded = True
+
+
+def _check_whisper(to_codes: List[str] = None):
+    from .transcription import WHISPER_MODEL
+
+    # the english-only models cannot translate, the whisper model itself is loaded by transcription
+    if WHISPER_MODEL.endswith('.en'):
+        raise ValueError(f"the WHISPER backend needs a multilingual model, not {WHISPER_MODEL}")
+    # whisper only translates speech to english, and only when english is the one target, see speech_task
+    if to_codes is not None and list(to_codes) != ['en']:
+        raise ValueError(f"the WHISPER backend only translates speech to english, not to {', '.join(to_codes)}")
+
+
+def _load_argos(from_code: str, to_codes: List[str]):
+    global argostranslate, ensure_argos_package
     import argostranslate.translate
+    from .argos_packages import ensure_package as ensure_argos_package
+
+    _ensure_argos_packages(from_code, to_codes)
+
+
+def _ensure_argos_packages(from_code: str, to_codes: List[str]):
+    # the package index is downloaded again once it is older than ARGOS_INDEX_REFRESH_HOURS, a package only when it is
+    # missing or the index has a newer version of it
+    for code in to_codes:
+        if code != from_code:
+            ensure_argos_package(from_code, code)
+
+
+# repeated phrases skip the network round-trip (DeepL, Google) or the forward pass (Argos)
+translation_cache = TranslationCache() if TRANSLATION_CACHE_SIZE > 0 else None
+
+
+class FallbackTranslation(str):
+    """Text argos translated while the online api was unavailable.
+
+    It is returned like any other translation but never cached, so the api's translation replaces it once it is back.
+    """
+
+
+def speech_task(to_code: str) -> str:
+    """Whisper task for speech that ends up in to_code.
+
+    With the WHISPER backend, whisper translates speech to english in the same pass that transcribes it, so its output
+    needs no further translation. Every other case transcribes, then translates the text with translate().
+    """
+    if TRANSLATION_BACKEND == TranslationBackend.WHISPER and to_code == 'en':
+        return 'translate'
+    return 'transcribe'
+
+
+def translate(text: str, from_code: str, to_code: str) -> str:
+    if translation_cache is None:
+        return _traced_translate(text, from_code, to_code)
 
-    # Download and install Argos Translate package
-    argostranslate.package.update_package_index()
-    available_packages = argostranslate.package.get_available_packages()
-    package_to_install = next(
-        filter(
-            lambda x: x.to_code == TARGET_LANGUAGE_CODE, available_packages
-        )
-    )
-    print("INSTALL BEGIN")
-    argostranslate.package.install_from_path(package_to_install.download())
-    print("INSTALL ENDED")
+    key = translation_key(TRANSLATION_BACKEND.value, from_code, to_code, text)
+    translated = translation_cache.get(key)
+    if translated is not None:
+        logger.debug(f"translation cache hit ({translation_cache.hits} hits, {translation_cache.misses} misses)")
+        tracing.count('translation_cache_hits_total')
+        return translated
 
-elif TRANSLATION_BACKEND == TranslationBackend.GOOGLE:
-    import googletrans
+    translated = _traced_translate(text, from_code, to_code)
+    if not isinstance(translated, FallbackTranslation):
+        translation_cache.put(key, translated, _cache_ttl())
+    return translated
 
-    google_translator = googletrans.Translator()
 
-elif TRANSLATION_BACKEND == TranslationBackend.DEEPL:
-    import deepl
+def _traced_translate(text: str, from_code: str, to_code: str) -> str:
+    with tracing.span('translate', backend=TRANSLATION_BACKEND.value, from_code=from_code, to_code=to_code,
+                      characters=len(text)):
+        return _translate(text, from_code, to_code)
 
-    deepl_translator = deepl.Translator(DEEPL_AUTH_KEY)
 
-elif TRANSLATION_BACKEND == TranslationBackend.WHISPER:
-    raise NotImplementedError()
+def _cache_ttl() -> float:
+    # online translations may improve over time, local argos ones do not
+    return 0 if TRANSLATION_BACKEND == TranslationBackend.ARGO else TRANSLATION_CACHE_TTL
 
 
-def translate(text: str, from_code: str, to_code: str):
+def translate_batch(texts: List[str], from_code: str, to_code: str, batch_size: int = TRANSLATION_BATCH_SIZE) -> List[str]:
+    """Translate several texts with as few backend calls as possible, results are in the same order as texts."""
+    results = [None] * len(texts)
+    missing = {}
+    for i, text in enumerate(texts):
+        key = translation_key(TRANSLATION_BACKEND.value, from_code, to_code, text)
+        cached = translation_cache.get(key) if translation_cache is not None else None
+        if cached is not None:
+            results[i] = cached
+        else:
+            # identical texts are only sent once
+            missing.setdefault(text, []).append(i)
+
+    pending = list(missing)
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        with tracing.span('translate_batch', backend=TRANSLATION_BACKEND.value, from_code=from_code, to_code=to_code,
+                          texts=len(batch)):
+            translations = _translate_batch(batch, from_code, to_code)
+        for text, translated in zip(batch, translations):
+            for i in missing[text]:
+                results[i] = translated
+            if translation_cache is not None and not isinstance(translated, FallbackTranslation):
+                key = translation_key(TRANSLATION_BACKEND.value, from_code, to_code, text)
+                translation_cache.put(key, translated, _cache_ttl())
+    return results
+
+
+def _translate(text: str, from_code: str, to_code: str) -> str:
+    load()
+
+    if http_client is not None:
+        return _translate_online([text], from_code, to_code)[0]
+
     if TRANSLATION_BACKEND == TranslationBackend.DEEPL:
         return deepl_translator.translate_text(
-            text, target_lang=TARGET_LANGUAGE_CODE)
+            text, target_lang=DEEPL_TARGET_LANGUAGES.get(to_code, to_code)).text
 
     if TRANSLATION_BACKEND == TranslationBackend.GOOGLE:
         return google_translator.translate(
-            text, dest=TARGET_LANGUAGE_CODE).text
+            text, dest=to_code).text
 
     if TRANSLATION_BACKEND == TranslationBackend.ARGO:
+        # whisper may detect a language other than SOURCE_LANGUAGE_CODE, e.g. in the subtitler
+        ensure_argos_package(from_code, to_code)
         return argostranslate.translate.translate(text, from_code, to_code)
+
+    if TRANSLATION_BACKEND == TranslationBackend.WHISPER:
+        # only reached for text that was not translated by whisper, see speech_task
+        raise ValueError(f"the WHISPER backend only translates speech to english, "
+                         f"not text from {from_code} to {to_code}")
+
+
+def _translate_online(texts: List[str], from_code: str, to_code: str) -> List[str]:
+    target = DEEPL_TARGET_LANGUAGES.get(to_code, to_code) if TRANSLATION_BACKEND == TranslationBackend.DEEPL else to_code
+    try:
+        return http_client.run(texts, from_code, target)
+    except TranslationError as e:
+        if not argos_fallback:
+            raise
+        # worse than deepl or google, but a subtitle now beats a perfect one never
+        logger.warning(f"{http_client.name} unavailable ({e}), translating with argos instead")
+        tracing.count('translation_fallbacks_total', backend=http_client.name)
+        ensure_argos_package(from_code, to_code)
+        return [FallbackTranslation(argostranslate.translate.translate(text, from_code, to_code)) for text in texts]
+
+
+def _translate_batch(texts: List[str], from_code: str, to_code: str) -> List[str]:
+    load()
+
+    if http_client is not None:
+        return _translate_online(texts, from_code, to_code)
+
+    if TRANSLATION_BACKEND == TranslationBackend.DEEPL:
+        # a single request for the whole list
+        results = deepl_translator.translate_text(
+            texts, target_lang=DEEPL_TARGET_LANGUAGES.get(to_code, to_code))
+        return [result.text for result in results]
+
+    if TRANSLATION_BACKEND == TranslationBackend.GOOGLE:
+        results = google_translator.translate(texts, dest=to_code)
+        return [result.text for result in results]
+
+    if TRANSLATION_BACKEND == TranslationBackend.ARGO:
+        # argos has no list api, but looking the model up once saves redoing it for every text
+        ensure_argos_package(from_code, to_code)
+        translation = argostranslate.translate.get_translation_from_codes(from_code, to_code)
+        return [translation.translate(text) for text in texts]
+
+    return [_translate(text, from_code, to_code) for text in texts]
+
+
+class BatchTranslator:
+    """Groups translate calls made from several threads into batches for translate_batch."""
+
+    def __init__(self, batch_size: int = TRANSLATION_BATCH_SIZE,
+                 max_latency: float = TRANSLATION_BATCH_LATENCY_MS / 1000, producers: int = 1):
+        self.batch_size = batch_size
+        # a single producer waits for its own result, so nobody else can join its batch and waiting is pure latency
+        self.max_latency = max_latency if producers > 1 else 0.0
+        self._requests = Queue()
+        Thread(target=self._run, name='batch-translator', daemon=True).start()
+
+    def submit(self, text: str, from_code: str, to_code: str) -> Future:
+        future = Future()
+        self._requests.put((text, from_code, to_code, future))
+        return future
+
+    def translate(self, text: str, from_code: str, to_code: str) -> str:
+        return self.submit(text, from_code, to_code).result()
+
+    def _collect(self) -> list:
+        # wait for a first request and take whatever queued up during the last batch, then wait for more only
+        # until the batch is full or the latency budget is spent
+        batch = [self._requests.get()]
+        deadline = time.time() + self.max_latency
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._requests.get_nowait())
+                continue
+            except Empty:
+                pass
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._requests.get(timeout=timeout))
+            except Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            groups = {}
+            for text, from_code, to_code, future in self._collect():
+                groups.setdefault((from_code, to_code), []).append((text, future))
+
+            for (from_code, to_code), requests in groups.items():
+                try:
+                    translated = translate_batch([text for text, _ in requests], from_code, to_code)
+                except Exception as e:
+                    for _, future in requests:
+                        future.set_exception(e)
+                    continue
+                for (_, future), result in zip(requests, translated):
+                    future.set_result(result)
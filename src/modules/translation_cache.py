@@ -0,0 +1,80 @@
+import sqlite3
+import time
+from collections import OrderedDict
+from os import getenv
+from threading import Lock
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from .chunking import normalize_text
+
+load_dotenv()
+
+TRANSLATION_CACHE_SIZE = int(getenv('TRANSLATION_CACHE_SIZE', 1024))
+# seconds before a translation from an online backend is requested again, 0 keeps them forever
+TRANSLATION_CACHE_TTL = float(getenv('TRANSLATION_CACHE_TTL', 86400))
+# sqlite file the cache is persisted to, leave empty to only keep it in memory
+TRANSLATION_CACHE_PATH = getenv('TRANSLATION_CACHE_PATH', '')
+
+
+def translation_key(backend: str, from_code: str, to_code: str, text: str) -> str:
+    return '\0'.join([backend, from_code or '', to_code or '', normalize_text(text)])
+
+
+class TranslationCache:
+    """Size bounded LRU of translations with an optional ttl and an optional sqlite backing file."""
+
+    def __init__(self, size: int = TRANSLATION_CACHE_SIZE, path: str = TRANSLATION_CACHE_PATH):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._db = None
+        if path:
+            # the pipeline translates from worker threads, every access goes through self._lock
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS translations '
+                             '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)')
+            self._db.execute('DELETE FROM translations WHERE expires IS NOT NULL AND expires < ?', (time.time(),))
+            self._db.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                entry = self._db.execute('SELECT value, expires FROM translations WHERE key = ?', (key,)).fetchone()
+                if entry is not None:
+                    self._remember(key, entry)
+
+            if entry is not None and (entry[1] is None or entry[1] > now):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            if entry is not None:
+                self._forget(key)
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: str, ttl: float = 0):
+        entry = (value, time.time() + ttl if ttl else None)
+        with self._lock:
+            self._remember(key, entry)
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO translations VALUES (?, ?, ?)', (key, *entry))
+                self._db.commit()
+
+    def _remember(self, key: str, entry: tuple):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def _forget(self, key: str):
+        self._entries.pop(key, None)
+        if self._db is not None:
+            self._db.execute('DELETE FROM translations WHERE key = ?', (key,))
+            self._db.commit()
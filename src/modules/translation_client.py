@@ -0,0 +1,299 @@
+import asyncio
+import json
+from abc import ABC, abstractmethod
+import random
+import time
+from http.client import HTTPConnection, HTTPException, HTTPSConnection, RemoteDisconnected
+from os import getenv
+from queue import Empty, LifoQueue
+from threading import Lock, Semaphore
+from typing import List, Optional
+from urllib.parse import urlencode, urlsplit
+
+from dotenv import load_dotenv
+
+from . import tracing
+from .logger import logger
+from .runtime import Runtime
+
+load_dotenv()
+
+# seconds a translation may take in total, retries and hedged requests included
+TRANSLATION_TIMEOUT = float(getenv('TRANSLATION_TIMEOUT', 3))
+# a second, identical request is sent when the first one has not answered after this many ms, 0 turns it off
+TRANSLATION_HEDGE_MS = float(getenv('TRANSLATION_HEDGE_MS', 800))
+# failed requests are retried with exponential backoff as long as the deadline allows
+TRANSLATION_RETRIES = int(getenv('TRANSLATION_RETRIES', 2))
+# keep-alive connections kept open to the translation api
+TRANSLATION_POOL_SIZE = int(getenv('TRANSLATION_POOL_SIZE', 4))
+# consecutive failed translations before the api is skipped for TRANSLATION_BREAKER_RESET seconds
+TRANSLATION_BREAKER_FAILURES = int(getenv('TRANSLATION_BREAKER_FAILURES', 3))
+TRANSLATION_BREAKER_RESET = float(getenv('TRANSLATION_BREAKER_RESET', 30))
+# base delay of the exponential backoff
+BACKOFF_SECONDS = 0.2
+
+
+class TranslationError(Exception):
+    def __init__(self, message: str, retryable: bool = True, retry_after: float = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class CircuitOpen(TranslationError):
+    def __init__(self, name: str):
+        super().__init__(f"{name} failed too often, not calling it for now", retryable=False)
+
+
+class ConnectionPool:
+    """Keep-alive http connections to one host, at most `size` requests are in flight at once."""
+
+    def __init__(self, base_url: str, size: int = TRANSLATION_POOL_SIZE):
+        url = urlsplit(base_url)
+        self.https = url.scheme == 'https'
+        self.host = url.hostname
+        self.port = url.port
+        self.prefix = url.path.rstrip('/')
+        self._idle = LifoQueue()
+        self._slots = Semaphore(size)
+
+    def _connect(self, timeout: float):
+        connection_class = HTTPSConnection if self.https else HTTPConnection
+        return connection_class(self.host, self.port, timeout=timeout)
+
+    def _connection(self, timeout: float):
+        # the most recently used connection is the least likely to have been closed by the server
+        try:
+            return self._idle.get_nowait(), True
+        except Empty:
+            return self._connect(timeout), False
+
+    def request(self, method: str, path: str, body: bytes = None, headers: dict = None, timeout: float = None):
+        """Blocking request, returns (status, headers, body)."""
+        with self._slots:
+            connection, reused = self._connection(timeout)
+            while True:
+                try:
+                    connection.timeout = timeout
+                    if connection.sock is not None:
+                        connection.sock.settimeout(timeout)
+                    connection.request(method, self.prefix + path, body, headers or {})
+                    response = connection.getresponse()
+                    data = response.read()
+                except (RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    connection.close()
+                    if not reused:
+                        raise
+                    # the server closed an idle keep-alive connection, try once more on a fresh one
+                    connection, reused = self._connect(timeout), False
+                    continue
+                except BaseException:
+                    connection.close()
+                    raise
+                break
+
+            if response.will_close:
+                connection.close()
+            else:
+                self._idle.put(connection)
+            return response.status, response.headers, data
+
+
+class CircuitBreaker:
+    """Opens after `failures` failures in a row, then lets a single trial call through every `reset_after` seconds."""
+
+    def __init__(self, failures: int = TRANSLATION_BREAKER_FAILURES, reset_after: float = TRANSLATION_BREAKER_RESET):
+        self.failures = failures
+        self.reset_after = reset_after
+        self._failed = 0
+        self._opened_at: Optional[float] = None
+        self._lock = Lock()
+
+    @property
+    def open(self) -> bool:
+        return self._opened_at is not None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.time() - self._opened_at >= self.reset_after:
+                # half open: this call is the trial, the others keep failing fast until it is done
+                self._opened_at = time.time()
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self._failed = 0
+            self._opened_at = None
+
+    def failure(self):
+        with self._lock:
+            self._failed += 1
+            if self._failed >= self.failures:
+                self._opened_at = time.time()
+
+
+class TranslationClient(ABC):
+    """Async client for an online translation api with deadlines, hedged requests, backoff and a circuit breaker.
+
+    Requests are blocking http calls on the client's own runtime threads, translate() can be awaited on that
+    runtime's loop and run() calls it from any other thread.
+    """
+
+    name = 'http'
+
+    def __init__(self, base_url: str, timeout: float = TRANSLATION_TIMEOUT,
+                 hedge_after: float = TRANSLATION_HEDGE_MS / 1000, retries: int = TRANSLATION_RETRIES,
+                 pool_size: int = TRANSLATION_POOL_SIZE):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.retries = retries
+        self.pool = ConnectionPool(base_url, pool_size)
+        self.breaker = CircuitBreaker()
+        # a 429 holds back every request until the api's Retry-After has passed
+        self._blocked_until = 0.0
+        # hedged requests need threads of their own on top of the pool's connections
+        self.runtime = Runtime(workers=pool_size * 2)
+        self.runtime.start_in_thread()
+
+    def run(self, texts: List[str], from_code: str, to_code: str) -> List[str]:
+        return self.runtime.call(self.translate(texts, from_code, to_code))
+
+    async def translate(self, texts: List[str], from_code: str, to_code: str) -> List[str]:
+        if not self.breaker.allow():
+            raise CircuitOpen(self.name)
+        try:
+            translated = await asyncio.wait_for(self._translate(texts, from_code, to_code), self.timeout)
+        except asyncio.TimeoutError:
+            self._failed()
+            raise TranslationError(f"{self.name} did not answer within {self.timeout}s")
+        except TranslationError:
+            self._failed()
+            raise
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            # the api answered 200 with something that is not a translation
+            self._failed()
+            raise TranslationError(f"{self.name} sent an unexpected answer: {e!r}", retryable=False)
+        self.breaker.success()
+        tracing.gauge('circuit_open', 0, backend=self.name)
+        return translated
+
+    def _failed(self):
+        self.breaker.failure()
+        if self.breaker.open:
+            logger.warning(f"[{self.name}] circuit open, skipping it for {self.breaker.reset_after}s")
+            tracing.gauge('circuit_open', 1, backend=self.name)
+
+    @abstractmethod
+    async def _translate(self, texts: List[str], from_code: str, to_code: str) -> List[str]:
+        # one translation per text, in the same order
+        pass
+
+    async def request(self, method: str, path: str, body: bytes = None, headers: dict = None) -> bytes:
+        """Send a request, retrying failures and hedging slow answers until the deadline set by translate()."""
+        deadline = time.time() + self.timeout
+        attempt = 0
+        while True:
+            # wait out a rate limit another request ran into instead of adding to it
+            wait = self._blocked_until - time.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                return await self._hedged(method, path, body, headers, deadline)
+            except TranslationError as e:
+                if not e.retryable or attempt >= self.retries:
+                    raise
+                delay = e.retry_after if e.retry_after is not None else BACKOFF_SECONDS * 2 ** attempt
+                # full jitter, so instances that failed together do not retry together
+                delay = delay if e.retry_after is not None else random.uniform(0, delay)
+                if time.time() + delay >= deadline:
+                    raise
+                attempt += 1
+                tracing.count('translation_retries_total', backend=self.name)
+                logger.debug(f"[{self.name}] {e}, retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def _hedged(self, method, path, body, headers, deadline) -> bytes:
+        loop = asyncio.get_running_loop()
+        tasks = [loop.create_task(self.runtime.run_blocking(self._send, method, path, body, headers, deadline))]
+        error = None
+        try:
+            while tasks:
+                hedge = self.hedge_after > 0 and len(tasks) == 1 and error is None
+                done, _ = await asyncio.wait(tasks, timeout=self.hedge_after if hedge else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # the first request is slow, whichever of the two answers first wins
+                    tracing.count('translation_hedges_total', backend=self.name)
+                    tasks.append(loop.create_task(
+                        self.runtime.run_blocking(self._send, method, path, body, headers, deadline)))
+                    continue
+                for task in done:
+                    tasks.remove(task)
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # the losing request still runs on its thread, its result or error is dropped
+            for task in tasks:
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    def _send(self, method, path, body, headers, deadline) -> bytes:
+        timeout = deadline - time.time()
+        if timeout <= 0:
+            raise TranslationError(f"{self.name} deadline passed", retryable=False)
+        try:
+            status, response_headers, data = self.pool.request(method, path, body, headers, timeout)
+        except (OSError, HTTPException) as e:
+            raise TranslationError(f"{self.name} request failed: {e!r}")
+
+        if status == 200:
+            return data
+        if status in (429, 503):
+            retry_after = response_headers.get('Retry-After')
+            retry_after = float(retry_after) if retry_after and retry_after.isdigit() else None
+            if retry_after is not None:
+                self._blocked_until = max(self._blocked_until, time.time() + retry_after)
+            raise TranslationError(f"{self.name} rate limited ({status})", retry_after=retry_after)
+        # other client errors (bad key, quota exceeded) do not go away by asking again
+        raise TranslationError(f"{self.name} answered {status}: {data[:200]!r}", retryable=status >= 500)
+
+
+class DeepLClient(TranslationClient):
+    name = 'deepl'
+
+    def __init__(self, auth_key: str, base_url: str = None, **kwargs):
+        # free api keys end with :fx and have their own host
+        base_url = base_url or ('https://api-free.deepl.com' if auth_key.endswith(':fx') else 'https://api.deepl.com')
+        super().__init__(base_url, **kwargs)
+        self.auth_key = auth_key
+
+    async def _translate(self, texts: List[str], from_code: str, to_code: str) -> List[str]:
+        # every text goes into one request
+        body = urlencode([('text', text) for text in texts] + [('target_lang', to_code)]).encode('utf-8')
+        data = await self.request('POST', '/v2/translate', body, {
+            'Authorization': f'DeepL-Auth-Key {self.auth_key}',
+            'Content-Type': 'application/x-www-form-urlencoded',
+        })
+        return [translation['text'] for translation in json.loads(data)['translations']]
+
+
+class GoogleClient(TranslationClient):
+    name = 'google'
+
+    def __init__(self, base_url: str = None, **kwargs):
+        super().__init__(base_url or 'https://translate.googleapis.com', **kwargs)
+
+    async def _translate(self, texts: List[str], from_code: str, to_code: str) -> List[str]:
+        # one text per request, sent side by side over the pool's connections
+        return list(await asyncio.gather(*(self._translate_one(text, to_code) for text in texts)))
+
+    async def _translate_one(self, text: str, to_code: str) -> str:
+        query = urlencode({'client': 'gtx', 'sl': 'auto', 'tl': to_code, 'dt': 't', 'q': text})
+        data = await self.request('GET', f'/translate_a/single?{query}')
+        # [[[translated sentence, source sentence, ...], ...], ...]
+        return ''.join(sentence[0] for sentence in json.loads(data)[0] if sentence[0])
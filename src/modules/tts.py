@@ -1,56 +1,160 @@
+import time
 from os import getenv
-from pathlib import Path
+from queue import Queue
+from threading import Lock, Thread
 from dotenv import load_dotenv
-import soundfile as sf
 import sounddevice as sd
 from pynput.keyboard import Controller
+from . import tracing
+from .audio import PCM
+from .chunking import split_sentences
+from .languages import TARGET_LANGUAGE_CODES, parse_language_map
 from .logger import logger
+from .tts_cache import cache_key, tts_cache
 
 load_dotenv()
 
-# only import voicevox's speak function when translating to japanese
-TARGET_LANGUAGE_CODE = getenv('TARGET_LANGUAGE_CODE')
-if TARGET_LANGUAGE_CODE == 'ja':
-    from .portable_voicevox import tts_generate_wav_jp
-else:
-    from .tts_multi import tts_generate_wav_multi as speak_multi
-
-TTS_WAV_PATH = Path(__file__).resolve(
-).parent.parent / 'audio' / r'tts.wav'
-
 # Keyboard
 INGAME_PUSH_TO_TALK_KEY = getenv('INGAME_PUSH_TO_TALK_KEY')
 keyboard = Controller()
+# players currently holding the push to talk key, it is released when the last of them finishes
+_talking = 0
+_talk_lock = Lock()
 
 # Audio devices
 CABLE_INPUT_ID = int(getenv('CABLE_INPUT_ID'))
+# output device per target language, e.g. "ja:12,de:14", languages not listed play on CABLE_INPUT_ID
+TARGET_OUTPUT_IDS = {code: int(device) for code, device in parse_language_map(getenv('TARGET_OUTPUT_IDS', '')).items()}
+
+
+def press_talk_key():
+    global _talking
+    if not INGAME_PUSH_TO_TALK_KEY:
+        return
+    with _talk_lock:
+        _talking += 1
+        if _talking == 1:
+            keyboard.press(INGAME_PUSH_TO_TALK_KEY)
+
+
+def release_talk_key():
+    # target languages play side by side, the first one to finish must not cut the others off
+    global _talking
+    if not INGAME_PUSH_TO_TALK_KEY:
+        return
+    with _talk_lock:
+        _talking -= 1
+        if _talking == 0:
+            keyboard.release(INGAME_PUSH_TO_TALK_KEY)
+
+
+def _voicevox():
+    # engines are imported the first time a language needs them, voicevox for japanese and coqui for the others,
+    # so a language picked on the command line works even when .env targets another one
+    from . import portable_voicevox
+    return portable_voicevox
+
+
+def _coqui():
+    from . import tts_multi
+    return tts_multi
+
+
+def load():
+    # the voice of every target language is loaded up front, so no utterance waits for a model
+    # and a language without a voice fails here instead of on every utterance
+    for code in TARGET_LANGUAGE_CODES:
+        if code != 'ja' and code not in _coqui().models:
+            raise ValueError(f"no text to speech voice for {code}, add a coqui model for it to tts_multi.models")
+    if 'ja' in TARGET_LANGUAGE_CODES:
+        _voicevox().load()
+    if any(code != 'ja' for code in TARGET_LANGUAGE_CODES):
+        _coqui().load()
+
+
+def output_device(language_code) -> int:
+    return TARGET_OUTPUT_IDS.get(language_code, CABLE_INPUT_ID)
 
 
-def play_voice(device_id):
-    data, fs = sf.read(TTS_WAV_PATH, dtype='float32')
+class SpeechStream:
+    """Synthesized chunks handed from the synthesizer to the player as soon as each one is ready."""
 
-    if INGAME_PUSH_TO_TALK_KEY:
-        keyboard.press(INGAME_PUSH_TO_TALK_KEY)
+    def __init__(self):
+        self._queue = Queue()
 
-    logger.info("speaking now..")
-    sd.play(data, fs, device=device_id, blocking=True)
-    # sd.wait()
-    logger.info("finished speaking")
+    def put(self, data, fs):
+        self._queue.put((data, fs))
 
-    if INGAME_PUSH_TO_TALK_KEY:
-        keyboard.release(INGAME_PUSH_TO_TALK_KEY)
+    def close(self):
+        self._queue.put(None)
+
+    def __iter__(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                return
+            yield chunk
+
+
+def play_stream(chunks, device_id):
+    # every chunk is written into one continuous output stream, so there are no gaps between clauses
+    output = None
+    try:
+        for data, fs in chunks:
+            if output is None:
+                channels = 1 if data.ndim == 1 else data.shape[1]
+                # voicevox chunks are int16 views over its wav bytes and are written without conversion
+                output = sd.OutputStream(samplerate=fs, channels=channels, dtype=data.dtype.name, device=device_id)
+                # pressed as soon as the stream exists, so the release in finally always has a press to match
+                press_talk_key()
+                output.start()
+                logger.info("speaking now..")
+                trace = tracing.current_trace()
+                if trace:
+                    trace.mark('first_audio', once=True)
+            output.write(data.reshape(len(data), -1))
+    finally:
+        if output is not None:
+            # stop() lets the queued audio play out, unlike abort()
+            output.stop()
+            output.close()
+            logger.info("finished speaking")
+            release_talk_key()
+
+
+def play_voice(data, fs, device_id):
+    press_talk_key()
+    try:
+        logger.info("speaking now..")
+        sd.play(data, fs, device=device_id, blocking=True)
+        # sd.wait()
+        logger.info("finished speaking")
+    finally:
+        release_talk_key()
 
 
 # Text-to-Speech, feel free to add your own function or add more languages
-def speak(sentence, language_code):
-    # Japanese
-    if language_code == 'ja':
-        tts_generate_wav_jp(sentence)
-        pass
+# every synthesizer returns a PCM(samples, sample_rate) tuple held in memory
+def synthesize(sentence, language_code) -> PCM:
+    # stock phrases are synthesized once and then served from the cache
+    key = None
+    if tts_cache is not None:
+        key = cache_key(sentence, _voicevox().VOICE_NAME if language_code == 'ja' else _coqui().voice_name(language_code))
+        cached = tts_cache.get(key)
+        if cached is not None:
+            logger.debug(f"tts cache hit: {tts_cache.stats()}")
+            tracing.count('tts_cache_hits_total')
+            return cached
+
+    with tracing.span('tts', language=language_code, characters=len(sentence)) as span:
+        # Japanese
+        if language_code == 'ja':
+            pcm = _voicevox().tts_generate_wav_jp(sentence)
 
-    else:
-        speak_multi(sentence, language_code)
-        pass
+        else:
+            pcm = _coqui().tts_generate_wav_multi(sentence, language_code)
+        # the real time factor of tts is synthesis time over the length of the speech it made
+        span.set(audio_seconds=len(pcm.samples) / pcm.sample_rate)
 
     # elif language_code == 'en':
     #     speak_multi(sentence, language_code)
@@ -81,4 +185,25 @@ def speak(sentence, language_code):
     # elif language_code == 'de':
     #     pass
 
-    play_voice(CABLE_INPUT_ID)
+    if key is not None:
+        tts_cache.put(key, pcm)
+    return pcm
+
+
+
+def synthesize_chunks(sentence, language_code, stream: SpeechStream):
+    # synthesize clause by clause so playback can start as soon as the first one is ready
+    start = time.time()
+    try:
+        for chunk in split_sentences(sentence):
+            data, fs = synthesize(chunk, language_code)
+            stream.put(data, fs)
+            logger.debug(f"synthesized chunk '{chunk}' | took {time.time() - start}")
+    finally:
+        stream.close()
+
+
+def speak(sentence, language_code):
+    stream = SpeechStream()
+    Thread(target=synthesize_chunks, args=[sentence, language_code, stream], daemon=True).start()
+    play_stream(stream, CABLE_INPUT_ID)
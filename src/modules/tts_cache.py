@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from os import getenv
+from pathlib import Path
+from threading import Lock
+from typing import Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from .audio import PCM
+from .chunking import normalize_text
+from .logger import logger
+
+load_dotenv()
+
+TTS_CACHE = getenv('TTS_CACHE', 'True').lower() in ('true', '1', 't')
+TTS_CACHE_MEMORY_MB = float(getenv('TTS_CACHE_MEMORY_MB', 64))
+TTS_CACHE_DISK_MB = float(getenv('TTS_CACHE_DISK_MB', 512))
+TTS_CACHE_DIR = Path(getenv('TTS_CACHE_DIR', Path(__file__).resolve().parent.parent / 'audio' / 'tts_cache'))
+
+
+def cache_key(text: str, voice: str) -> str:
+    # voice identifies the engine, its version and the speaker / model, e.g. voicevox-0.14.3/42
+    return hashlib.sha256(f'{voice}\0{normalize_text(text)}'.encode('utf-8')).hexdigest()
+
+
+class TTSCache:
+    """Content addressed cache of synthesized audio, an in-memory LRU in front of a directory of raw PCM blobs."""
+
+    def __init__(self, directory: Path = TTS_CACHE_DIR, memory_budget: int = int(TTS_CACHE_MEMORY_MB * 2 ** 20),
+                 disk_budget: int = int(TTS_CACHE_DISK_MB * 2 ** 20)):
+        self.directory = Path(directory)
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._index_path = self.directory / 'index.json'
+        try:
+            self._index = OrderedDict(json.loads(self._index_path.read_text(encoding='utf-8')))
+        except (OSError, ValueError):
+            self._index = OrderedDict()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_bytes": self._memory_bytes,
+            "disk_entries": len(self._index),
+        }
+
+    def get(self, key: str) -> Optional[PCM]:
+        with self._lock:
+            pcm = self._memory.get(key)
+            if pcm is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return pcm
+
+            entry = self._index.get(key)
+            if entry is not None:
+                pcm = self._load(key, entry)
+                if pcm is not None:
+                    self._index.move_to_end(key)
+                    self._remember(key, pcm)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return pcm
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, pcm: PCM):
+        with self._lock:
+            self._remember(key, pcm)
+            self._store(key, pcm)
+
+    def _remember(self, key: str, pcm: PCM):
+        if pcm.samples.nbytes > self.memory_budget:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= previous.samples.nbytes
+        self._memory[key] = pcm
+        self._memory_bytes += pcm.samples.nbytes
+        while self._memory_bytes > self.memory_budget:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.samples.nbytes
+
+    def _load(self, key: str, entry: dict) -> Optional[PCM]:
+        try:
+            samples = np.fromfile(self.directory / f'{key}.pcm', dtype=entry["dtype"])
+        except OSError:
+            # blob was deleted from under us, forget about it
+            del self._index[key]
+            return None
+        if entry["channels"] > 1:
+            samples = samples.reshape(-1, entry["channels"])
+        return PCM(samples, entry["sample_rate"])
+
+    def _store(self, key: str, pcm: PCM):
+        samples = np.ascontiguousarray(pcm.samples)
+        blob = self.directory / f'{key}.pcm'
+        try:
+            samples.tofile(blob)
+            self._index[key] = {
+                "dtype": samples.dtype.name,
+                "channels": 1 if samples.ndim == 1 else samples.shape[1],
+                "sample_rate": pcm.sample_rate,
+                "bytes": samples.nbytes,
+            }
+            self._evict_disk()
+            # write the index next to it and swap it in so a crash never leaves a truncated index
+            tmp = self._index_path.with_suffix('.tmp')
+            tmp.write_text(json.dumps(self._index), encoding='utf-8')
+            os.replace(tmp, self._index_path)
+        except OSError:
+            logger.exception("failed to write tts cache entry")
+
+    def _evict_disk(self):
+        total = sum(entry["bytes"] for entry in self._index.values())
+        while total > self.disk_budget and len(self._index) > 1:
+            key, entry = self._index.popitem(last=False)
+            total -= entry["bytes"]
+            try:
+                os.remove(self.directory / f'{key}.pcm')
+            except OSError:
+                pass
+
+
+tts_cache = TTSCache() if TTS_CACHE else None
@@ -1,11 +1,15 @@
 import time
 from os import getenv
-from pathlib import Path
+from threading import Lock
 
+import numpy as np
 import torch.cuda
 from dotenv import load_dotenv
 from pynput.keyboard import Key, Controller
+from .audio import PCM
+from .languages import TARGET_LANGUAGE_CODES
 from .logger import logger
+from TTS import __version__ as TTS_VERSION
 from TTS.api import TTS
 
 load_dotenv()
@@ -18,28 +22,37 @@ INGAME_PUSH_TO_TALK_KEY = getenv('INGAME_PUSH_TO_TALK_KEY')
 keyboard = Controller()
 
 # TTS settings
-TARGET_LANGUAGE_CODE = getenv('TARGET_LANGUAGE_CODE')
-TTS_WAV_PATH = Path(__file__).resolve().parent.parent / 'audio' / r'tts.wav'
-
-# List available 🐸TTS models and choose the first one
-model_names = TTS.list_models()
-print(model_names)
-
 models = {
+    # english output is what the WHISPER translation backend produces
+    'en': 'tts_models/en/ljspeech/vits',
     'fr': 'tts_models/fr/thorsten/vits',
     'de': 'tts_models/de/thorsten/vits',
     'zh-CN': 'tts_models/zh-CN/baker/tacotron2-DDC-GST'
 }
 
-tts = TTS(models[TARGET_LANGUAGE_CODE], gpu=torch.cuda.is_available())
+# one loaded model per language, so switching languages never rebuilds one
+voices = {}
+_load_lock = Lock()
 
 
-def tts_generate_wav_multi(sentence: str, to_code: str):
-    start = time.time()
+def load(to_code: str = None):
+    # loads the model of to_code, or of every coqui target language, each language synthesizes on its own thread
+    codes = [to_code] if to_code else [code for code in TARGET_LANGUAGE_CODES if code != 'ja']
+    with _load_lock:
+        for code in codes:
+            if code not in voices:
+                voices[code] = TTS(models[code], gpu=torch.cuda.is_available())
+        return voices[codes[0]] if codes else None
+
 
-    # in case to_code is different from our cached model's lang
-    if TARGET_LANGUAGE_CODE != to_code:
-        tts = TTS(models[TARGET_LANGUAGE_CODE], gpu=torch.cuda.is_available())
+def voice_name(to_code: str) -> str:
+    # identifies the model that speaks to_code, part of the tts cache key
+    return f"coqui-{TTS_VERSION}/{models[to_code]}"
+
+
+def tts_generate_wav_multi(sentence: str, to_code: str) -> PCM:
+    start = time.time()
+    tts = load(to_code)
 
     if tts.is_multi_lingual:
         to_code = list(filter(lambda x: to_code in x, tts.languages))[0]
@@ -53,12 +66,12 @@ def tts_generate_wav_multi(sentence: str, to_code: str):
 
     # Run TTS
     # ❗ Since this model is multi-speaker and multilingual, we must set the target speaker and the language
-    # Text to speech to a file
-    tts.tts_to_file(text=sentence, speaker=speaker, language=to_code,
-                    file_path=str(TTS_WAV_PATH.resolve()))
-    logger.debug(f"synthesized to wav | took {time.time() - start}")
+    # Text to speech, kept in memory instead of going through a wav file
+    wav = tts.tts(text=sentence, speaker=speaker, language=to_code)
+    logger.debug(f"synthesized | took {time.time() - start}")
+    return PCM(np.asarray(wav, dtype=np.float32), tts.synthesizer.output_sample_rate)
 
 
 if __name__ == '__main__':
-    # TODO
-    pass
+    # List available 🐸TTS models
+    print(TTS.list_models())
@@ -0,0 +1,63 @@
+from os import getenv
+
+import numpy as np
+from dotenv import load_dotenv
+
+from .audio import WHISPER_SAMPLE_RATE
+
+load_dotenv()
+
+VAD = getenv('VAD', 'True').lower() in ('true', '1', 't')
+# a frame is speech when it is this many times louder than the background noise
+VAD_ENERGY_RATIO = float(getenv('VAD_ENERGY_RATIO', 3.0))
+# chunks where less than this share of frames is speech are not sent to whisper at all
+VAD_MIN_SPEECH_RATIO = float(getenv('VAD_MIN_SPEECH_RATIO', 0.1))
+# frames crossing zero more often than this are hiss or noise-like sound effects, not voice
+VAD_MAX_ZERO_CROSSING_RATE = float(getenv('VAD_MAX_ZERO_CROSSING_RATE', 0.35))
+FRAME_MS = 30
+# silence kept around speech so word onsets and endings are not cut off
+PADDING_MS = 300
+# quieter than this (about -50 dBFS) is never speech, whatever the noise floor is
+MIN_ENERGY = 0.003
+
+
+class VoiceActivityDetector:
+    """Energy and zero-crossing rate frame classifier with a noise floor that adapts across calls."""
+
+    def __init__(self, sample_rate: int = WHISPER_SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.frame_length = sample_rate * FRAME_MS // 1000
+        self.padding = PADDING_MS // FRAME_MS
+        self.noise_floor = None
+
+    def speech_frames(self, audio: np.ndarray) -> np.ndarray:
+        count = len(audio) // self.frame_length
+        if count == 0:
+            return np.zeros(0, dtype=bool)
+        frames = audio[:count * self.frame_length].reshape(count, self.frame_length)
+
+        energy = np.sqrt(np.mean(np.square(frames), axis=1))
+        zero_crossing_rate = np.mean(np.abs(np.diff(np.signbit(frames), axis=1)), axis=1)
+
+        # track the noise floor from the quietest frames, rising slowly and falling fast
+        quiet = float(np.percentile(energy, 10))
+        if self.noise_floor is None or quiet < self.noise_floor:
+            self.noise_floor = quiet
+        else:
+            self.noise_floor = 0.95 * self.noise_floor + 0.05 * quiet
+
+        threshold = max(MIN_ENERGY, self.noise_floor * VAD_ENERGY_RATIO)
+        speech = (energy > threshold) & (zero_crossing_rate < VAD_MAX_ZERO_CROSSING_RATE)
+
+        # hangover: keep a few frames around every speech frame
+        if self.padding and speech.any():
+            speech = np.convolve(speech, np.ones(2 * self.padding + 1), mode='same') > 0
+        return speech
+
+    def trim(self, audio: np.ndarray) -> np.ndarray:
+        """Cut leading and trailing silence, returns an empty array when the audio is mostly not speech."""
+        speech = self.speech_frames(audio)
+        if len(speech) == 0 or speech.mean() < VAD_MIN_SPEECH_RATIO:
+            return audio[:0]
+        voiced = np.flatnonzero(speech)
+        return audio[voiced[0] * self.frame_length:(voiced[-1] + 1) * self.frame_length]
@@ -1,8 +1,8 @@
 import time
 from os import getenv
-from pathlib import Path
 from dotenv import load_dotenv
 from pynput.keyboard import Key, Controller
+from .audio import PCM, wav_to_pcm
 from .logger import logger
 from voicevox_core import AccelerationMode, AudioQuery, VoicevoxCore
 
@@ -12,8 +12,6 @@ load_dotenv()
 # Voicevox settings
 OPEN_JTALK_DICT_DIR = getenv('OPEN_JTALK_DICT_DIR')
 VOICE_ID = int(getenv('VOICE_ID'))
-TTS_WAV_PATH = Path(__file__).resolve(
-).parent.parent / 'audio' / r'tts.wav'
 VOICEVOX_ACCELERATION_MODE = getenv("VOICEVOX_ACCELERATION_MODE", "CPU")
 
 print(f"[VOICEVOX] loading up voicevox core..")
@@ -24,7 +22,7 @@ core.load_model(VOICE_ID)
 print(f"[VOICEVOX] successfully loaded! running on {'gpu' if core.is_gpu_mode else 'cpu'}")
 
 
-def tts_generate_wav_jp(sentence: str):
+def tts_generate_wav_jp(sentence: str) -> PCM:
     start = time.time()
 
     logger.debug("querying voicevox")
@@ -36,8 +34,7 @@ def tts_generate_wav_jp(sentence: str):
     wav = core.synthesis(audio_query, VOICE_ID)
     logger.debug(f"synthesis took: {time.time() - start}")
 
-    TTS_WAV_PATH.write_bytes(wav)
-    logger.debug(f"wrote to wav file took: {time.time() - start}")
+    return wav_to_pcm(wav)
 
 
 if __name__ == '__main__':
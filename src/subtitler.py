@@ -1,14 +1,18 @@
 import signal
 import sys
-import textwrap
-import threading
 import tkinter as tk
+from collections import OrderedDict
+from functools import partial
 from os import getenv
-from queue import Queue
+from threading import Lock
 
 from dotenv import load_dotenv
 
-from modules.audio_translate import translate_audio
+from modules import tracing, transcription, translation
+from modules.audio_translate import INPUT_LANGUAGE, OUTPUT_LANGUAGE, translate_audio
+from modules.languages import TARGET_LANGUAGE_CODES
+from modules.startup import warm_up
+from modules.subtitles import SubtitleHistory, SubtitleUpdate
 
 load_dotenv()
 
@@ -18,36 +22,83 @@ SUBTITLE_FONT_SIZE = int(getenv('SUBTITLE_FONT_SIZE'))
 SUBTITLE_COLOR = getenv('SUBTITLE_COLOR')
 SUBTITLE_BG_COLOR = getenv('SUBTITLE_BG_COLOR')
 SACRIFICIAL_COLOR = getenv('SACRIFICIAL_COLOR')
+# how long a subtitle stays on screen when nothing newer arrives
+HIDE_AFTER_MS = 3000
 
 
-def subtitle_updater(root, queue, label):
-    # Check if there is something new in the queue to display.
-    while not queue.empty():
-        # destroy old label since new message inbound
-        label.destroy()
-        if root.wm_state() == 'withdrawn':
-            # show root window
-            root.deiconify()
+class SubtitleOverlay:
+    """A fixed set of line labels showing a SubtitleHistory, hidden by a single cancellable timer.
+
+    put() can be called from any thread. It only keeps the newest update of every phrase and wakes the Tk loop with
+    a virtual event, so a burst of partial results is drawn once. Only the labels whose line changed are touched.
+    """
 
-        # create subtitle based on message in queue
-        msg = queue.get()
-        label = tk.Label(
-            text=textwrap.fill(msg, 64),
+    EVENT = '<<Subtitle>>'
+
+    def __init__(self, root: tk.Tk, history: SubtitleHistory = None, hide_after_ms: int = HIDE_AFTER_MS):
+        self.root = root
+        self.history = history or SubtitleHistory()
+        self.hide_after_ms = hide_after_ms
+        # one label per line, the last one is at the bottom middle of the screen
+        self.labels = [tk.Label(
+            root,
             font=('Comic Sans MS', SUBTITLE_FONT_SIZE, 'bold italic'),
             fg=SUBTITLE_COLOR,
             bg=SUBTITLE_BG_COLOR
-        )
-
-        # hide root and destroy label after 3s
-        label.after(3000, root.withdraw)
-        label.after(3000, label.destroy)
-
-        # place subtitle at bottom middle of screen
-        label.pack(side='bottom', anchor='s')
-        root.update_idletasks()
-
-    # run every 0.5s
-    root.after(50, lambda: subtitle_updater(root, queue, label))
+        ) for _ in range(self.history.max_lines)]
+        self._pending = OrderedDict()
+        self._lock = Lock()
+        self._hide_timer = None
+        root.bind(self.EVENT, self._show)
+
+    def put(self, update: SubtitleUpdate):
+        with self._lock:
+            # only the first update since the last redraw needs to wake the loop, later ones are merged into it
+            wake = not self._pending
+            previous = self._pending.get(update.phrase_id)
+            if previous is None or not previous.final:
+                self._pending[update.phrase_id] = update
+        if wake:
+            # event_generate with when='tail' is the one Tk call that is safe from another thread
+            self.root.event_generate(self.EVENT, when='tail')
+
+    def _show(self, _event=None):
+        with self._lock:
+            updates, self._pending = self._pending, OrderedDict()
+        changed = False
+        for update in updates.values():
+            changed |= self.history.update(update)
+        if not changed:
+            return
+
+        self._render(self.history.lines())
+        if self.root.wm_state() == 'withdrawn':
+            # show root window
+            self.root.deiconify()
+
+        # a newer subtitle restarts the countdown instead of being hidden by an older one's timer
+        if self._hide_timer is not None:
+            self.root.after_cancel(self._hide_timer)
+        self._hide_timer = self.root.after(self.hide_after_ms, self._hide)
+
+    def _render(self, lines):
+        # lines are aligned to the bottom, empty labels are unpacked so they do not show their background
+        lines = [''] * (len(self.labels) - len(lines)) + lines
+        # bottom to top, so labels packed later stack above the ones already shown
+        for label, text in zip(reversed(self.labels), reversed(lines)):
+            if label.cget('text') == text:
+                continue
+            label.configure(text=text)
+            if not text:
+                label.pack_forget()
+            elif not label.winfo_manager():
+                label.pack(side='bottom', anchor='s')
+
+    def _hide(self):
+        self._hide_timer = None
+        self.root.withdraw()
+        self.history.clear()
+        self._render([])
 
 
 def setup_overlay():
@@ -78,18 +129,23 @@ def start_app():
     # catch keyboard interrupt to stop main thread
     signal.signal(signal.SIGINT, close_app)
 
-    overlay = setup_overlay()
-    subtitle = tk.Label()
-    subtitle_queue = Queue()
+    # whisper and the translator are ready before the first subtitle, already loaded when run by the voice translator
+    warm_up({
+        'whisper': transcription.load,
+        # the app's audio is most likely in the language the voice translator speaks, unless SUBTITLE_LANGUAGE_CODE says
+        'translation': partial(translation.load, [OUTPUT_LANGUAGE], INPUT_LANGUAGE or TARGET_LANGUAGE_CODES[0]),
+    })
 
-    # thread to listen and translate audio
-    threading.Thread(target=translate_audio, args=[subtitle_queue], daemon=True).start()
+    # no-op when the voice translator already started the exporters in this process
+    tracing.start()
+    root = setup_overlay()
+    overlay = SubtitleOverlay(root)
 
-    # updates subtitles every 0.5s by checking queue
-    subtitle_updater(overlay, subtitle_queue, subtitle)
+    # listen and translate audio in the background, subtitles are pushed straight to the overlay
+    translate_audio(overlay)
 
     # set full-screen applications to borderless window for subtitles to appear over it
-    overlay.mainloop()
+    root.mainloop()
 
 
 if __name__ == '__main__':
@@ -1,63 +1,222 @@
-import wave
+from functools import partial
 from os import getenv
-from pathlib import Path
+from types import GeneratorType
 from typing import Optional
 from pynput import keyboard
 from dotenv import load_dotenv
+from modules.audio import WHISPER_SAMPLE_RATE
 from modules.logger import logger
-import pyaudio
 import time
 
 logger.info("loading up modules..")
 
-from modules.transcription import transcribe
-from modules.translation import translate
-from modules.tts import speak
+from modules import tracing, transcription, translation, tts
+from modules.startup import warm_up
+from modules.transcription import transcribe_segments
+from modules.streaming_transcription import STREAMING_TRANSCRIPTION, StreamingTranscriber
+from modules.languages import TARGET_LANGUAGE_CODES
+from modules.translation import translate, speech_task
+from modules.tts import SpeechStream, synthesize_chunks, play_stream, output_device
+from modules.capture import CaptureEngine, Recording
+from modules.pipeline import Pipeline, Stage
+from modules.runtime import Runtime
+from modules.vad import VAD, VoiceActivityDetector
 
 load_dotenv()
-TARGET_LANGUAGE_CODE = getenv('TARGET_LANGUAGE_CODE')
 MIC_ID = int(getenv('MICROPHONE_ID'))
 RECORD_KEY = getenv('MIC_RECORD_KEY')
-MIC_AUDIO_PATH = Path(__file__).resolve(
-).parent / 'audio' / r'mic.wav'
-CHUNK = 1024
-FORMAT = pyaudio.paInt16
-
-recording = False
+# show the audio subtitler's overlay from this process as well, sharing the whisper model
+RUN_SUBTITLER = getenv('RUN_SUBTITLER', 'False').lower() in ('true', '1', 't')
+# the language whisper is told you speak, only when it is set in .env, otherwise whisper detects it
+SPOKEN_LANGUAGE_CODE = getenv('SOURCE_LANGUAGE_CODE') or None
+# 'translate' when whisper translates speech to english itself, the translate stage then has nothing to do
+SPEECH_TASK = speech_task(TARGET_LANGUAGE_CODES[0]) if len(TARGET_LANGUAGE_CODES) == 1 else 'transcribe'
+
+# only used by the transcribe stage's worker
+vad = VoiceActivityDetector() if VAD else None
+# set up in __main__, the key events below start and stop recordings on them
+runtime: Optional[Runtime] = None
+capture: Optional[CaptureEngine] = None
+pipeline: Optional[Pipeline] = None
+# only touched on the runtime's event loop
+recording: Optional[Recording] = None
+streamer: Optional[StreamingTranscriber] = None
+_DONE = object()
+
+
+def traced(name, handler):
+    # runs a stage handler with the utterance's trace active and records the time the stage spent on it
+    def run(utterance):
+        trace = utterance["trace"]
+        start = time.time()
+        with trace.activate():
+            result = handler(utterance)
+        if not isinstance(result, GeneratorType):
+            tracing.record(f'pipeline_{name}', time.time() - start, trace=trace)
+            return result
+        return steps(name, trace, result, time.time() - start)
+
+    return run
+
+
+def steps(name, trace, outputs, busy):
+    # time spent waiting for the next stage to take an output is not part of this stage's span
+    while True:
+        start = time.time()
+        with trace.activate():
+            output = next(outputs, _DONE)
+        busy += time.time() - start
+        if output is _DONE:
+            break
+        yield output
+    tracing.record(f'pipeline_{name}', busy, trace=trace)
+
+
+def start_recording():
+    global recording, streamer
+    # ignore key repeats while the key is held down
+    if recording is not None:
+        return
+    logger.info("starting recording")
+    # the mic is always open, a recording is just an offset into the capture buffer
+    recording = capture.recording()
+    # decodes the recording in the background while the record key is still held
+    if STREAMING_TRANSCRIPTION:
+        streamer = StreamingTranscriber(recording, language=SPOKEN_LANGUAGE_CODE, task=SPEECH_TASK)
+        streamer.start()
+
+
+async def stop_recording():
+    global recording, streamer
+    if recording is None:
+        return
+    logger.info("stopped recording")
+    start = time.time()
+    recording.stop()
+    utterance = {"audio": recording, "streamer": streamer, "start": start, "trace": tracing.start_trace()}
+    logger.debug(f"utterance {utterance['trace'].id}: {recording.duration:.2f}s of audio")
+    recording = None
+    streamer = None
+
+    # if empty audio file
+    if not len(utterance["audio"]):
+        if utterance["streamer"]:
+            await runtime.run_blocking(utterance["streamer"].finish)
+        logger.info("No audio file to transcribe detected.")
+    else:
+        await pipeline.submit(utterance)
 
 
 def on_press_key(key):
-    global recording
+    # runs on pynput's thread, hand the event over to the runtime
     try:
         if key.char == RECORD_KEY:
-            recording = True
+            runtime.post('record_start')
     except AttributeError:
         # logger.error(f"special key pressed: {key}")
         pass
 
 
 def on_release_key(key):
-    global recording
     try:
         if key.char == RECORD_KEY:
-            recording = False
+            runtime.post('record_stop')
     except AttributeError:
         # logger.error(f"special key pressed: {key}")
         pass
 
 
-if __name__ == '__main__':
-    logger.info(f"now running, translating to {TARGET_LANGUAGE_CODE}")
-    p = pyaudio.PyAudio()
+def transcribe_stage(utterance):
+    # transcribe (audio -> text), every segment goes on to translation as soon as it is decoded
+    if utterance["streamer"]:
+        # the text committed while recording goes first, then the tail that was left to decode
+        segments = utterance["streamer"].finish_segments()
+    else:
+        # resample microphone audio to 16kHz mono in memory
+        with tracing.span('capture', audio_seconds=utterance["audio"].duration):
+            mic_audio = utterance["audio"].to_whisper()
+        if vad:
+            # cut the silence before and after speaking, recordings without speech never reach whisper
+            with tracing.span('vad', audio_seconds=utterance["audio"].duration):
+                mic_audio = vad.trim(mic_audio)
+            if len(mic_audio) == 0:
+                logger.error('No speech detected.')
+                return
+        logger.debug(f"prepared {len(mic_audio) / WHISPER_SAMPLE_RATE:.2f}s of audio | total took {time.time() - utterance['start']}")
+        segments = transcribe_segments(mic_audio, SPOKEN_LANGUAGE_CODE, SPEECH_TASK)
+
+    count = 0
+    for segment in segments:
+        if not segment["text"].strip():
+            continue
+        logger.info(f'transcript (detected {segment["language"]}): {segment["text"]}')
+        logger.debug(f"transcribe segment {count} | total took {time.time() - utterance['start']}")
+        if SPEECH_TASK == 'translate':
+            segment = {**segment, "translation": segment["text"]}
+        yield {**utterance, **segment, "segment": count}
+        count += 1
+
+    if not count:
+        logger.error('No speech detected.')
+
+
+def translate_stage(target, utterance):
+    # translate (text -> text), the rest of this branch of the pipeline works on this target language
+    utterance = {**utterance, "target": target, "trace": utterance["trace"].branch(target=target)}
+    if "translation" in utterance:
+        # whisper translated it while transcribing
+        return utterance
+    translated = translate(utterance["text"], utterance["language"], target)
+    logger.info(f"translation ({target}): {translated}")
+    logger.debug(f"translate {target} | total took {time.time() - utterance['start']}")
+    return {**utterance, "translation": translated}
+
+
+def synthesize_stage(utterance):
+    # text to speech (text -> audio), the player receives the stream before the first chunk is synthesized
+    voice = SpeechStream()
+    yield {**utterance, "voice": voice}
+    synthesize_chunks(utterance["translation"], utterance["target"], voice)
+    logger.debug(f"tts {utterance['target']} | total took {time.time() - utterance['start']}")
+
+
+def play_stage(utterance):
+    play_stream(utterance["voice"], output_device(utterance["target"]))
+    logger.debug(f"played | total took {time.time() - utterance['start']}")
+    # from key release until this segment finished playing
+    utterance["trace"].mark('played', segment=utterance["segment"])
+    print("")
 
-    # get channels and sampling rate of mic
-    mic_info = p.get_device_info_by_index(MIC_ID)
-    MIC_CHANNELS = mic_info['maxInputChannels']
-    MIC_SAMPLING_RATE = int(mic_info['defaultSampleRate'])
 
-    frames = []
-    recording_last = False
-    stream: Optional[pyaudio.Stream] = None
+if __name__ == '__main__':
+    # whisper, the translator and the text to speech engine are loaded side by side
+    warm_up({
+        'whisper': transcription.load,
+        'translation': partial(translation.load, TARGET_LANGUAGE_CODES),
+        'tts': tts.load,
+    })
+
+    logger.info(f"now running, translating to {', '.join(TARGET_LANGUAGE_CODES)}")
+    tracing.start()
+
+    # key presses and stage hand-offs are events on this loop, nothing polls
+    runtime = Runtime()
+    runtime.on('record_start', start_recording)
+    runtime.on('record_stop', stop_recording)
+
+    # every stage runs on its own worker so the next recording is transcribed while the last one is still playing,
+    # whisper runs once per utterance and every target language gets its own translate, synthesize and play stages
+    pipeline = Pipeline([
+        Stage('transcribe', traced('transcribe', transcribe_stage)),
+    ], [[
+        Stage(f'translate-{code}', traced(f'translate_{code}', partial(translate_stage, code))),
+        Stage(f'synthesize-{code}', traced(f'synthesize_{code}', synthesize_stage)),
+        Stage(f'play-{code}', traced(f'play_{code}', play_stage)),
+    ] for code in TARGET_LANGUAGE_CODES])
+
+    # the mic stream stays open, so nothing is lost while a device opens when the record key goes down
+    capture = CaptureEngine(MIC_ID)
+    capture.start()
 
     listener = keyboard.Listener(
         on_press=on_press_key,
@@ -67,66 +226,17 @@ if __name__ == '__main__':
     print("")
 
     try:
-        while True:
-            if not recording_last and recording:
-                logger.info("starting recording")
-                frames = []
-                stream = p.open(format=FORMAT,
-                                channels=MIC_CHANNELS,
-                                rate=MIC_SAMPLING_RATE,
-                                input=True,
-                                frames_per_buffer=CHUNK,
-                                input_device_index=MIC_ID)
-
-            if recording and stream:
-                data = stream.read(CHUNK)
-                frames.append(data)
-
-            if recording_last and not recording:
-                logger.info("stopped recording")
-                start = time.time()
-                if stream is not None:
-                    stream.stop_stream()
-                    stream.close()
-                stream = None
-
-                # if empty audio file
-                if not frames:
-                    logger.info("No audio file to transcribe detected.")
-                    continue
-
-                # write microphone audio to file
-                mic_audio_path: str = str(MIC_AUDIO_PATH.resolve())
-                wf = wave.open(mic_audio_path, 'wb')
-                wf.setnchannels(MIC_CHANNELS)
-                wf.setsampwidth(p.get_sample_size(FORMAT))
-                wf.setframerate(MIC_SAMPLING_RATE)
-                wf.writeframes(b''.join(frames))
-                wf.close()
-                logger.debug(f"wrote audio file to os | total took {time.time() - start}")
-
-                # transcribe (audio -> text)
-                transcribed = transcribe(mic_audio_path)
-                logger.debug(f"transcribe | total took {time.time() - start}")
-                from_code = transcribed["language"]
-                speech = transcribed["text"]
-                if speech:
-                    logger.info(f'transcript (detected {from_code}): {speech}')
-                    # translate (text -> text)
-                    translated = translate(speech, from_code, TARGET_LANGUAGE_CODE)
-                    logger.info(f"translation: {translated}")
-                    logger.debug(f"translate | total took {time.time() - start}")
-                    # text to speech (text -> audio)
-                    speak(translated, TARGET_LANGUAGE_CODE)
-                    logger.debug(f"tts | total took {time.time() - start}")
-                    print("")
-
-                else:
-                    logger.error('No speech detected.')
-
-            recording_last = recording
-            if not recording:
-                time.sleep(0.01)
+        if RUN_SUBTITLER:
+            # tkinter needs the main thread, so the runtime moves to a thread of its own
+            import subtitler
+            runtime.start_in_thread(pipeline.run(runtime))
+            subtitler.start_app()
+        else:
+            runtime.run(pipeline.run(runtime))
 
     except KeyboardInterrupt:
         logger.info('Closing voice translator.')
+        listener.stop()
+        capture.close()
+        # utterances already recorded are still translated and spoken before the stage workers exit
+        runtime.finish(pipeline.close())